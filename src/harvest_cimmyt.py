@@ -10,6 +10,8 @@ from datetime import timedelta
 
 from requests_cache import CachedSession
 
+from util import get_metadata_value, get_metadata_values, prune_cache
+
 # Create a local logger instance for this module. We don't do any configuration
 # because this module might be used elsewhere that will have its own logging
 # configuration.
@@ -17,45 +19,18 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logging.basicConfig(format="%(message)s")
 
+# Use write-ahead logging in the SQLite cache so threads reading responses from
+# the cache are not blocked while another thread is saving one
 session = CachedSession(
-    "harvest-cache", expire_after=timedelta(days=30), allowable_codes=(200, 404)
+    "harvest-cache",
+    backend="sqlite",
+    wal=True,
+    expire_after=timedelta(days=30),
+    allowable_codes=(200, 404),
 )
 
-# prune old cache entries
-session.cache.delete(expired=True)
-
-
-url = "https://repository.cimmyt.org/server/api/discover/search/objects"
-params = {
-    "query": 'dc.date.issued:[2012 TO 2023] AND dc.type:Article AND (dc.title:"climate change" OR dc.subject.agrovoc:"climate change" OR dc.subject.keywords:"climate change" OR dc.description:"climate change" OR dc.description.abstract:"climate change" OR dcterms.description:"climate change") AND (dcterms.language:English OR dc.language:English)'
-}
-r = session.get(url, params=params)
-
-# Create empty list for items
-items = []
-
-if r.ok:
-    for item in r.json()["_embedded"]["searchResult"]["_embedded"]["objects"]:
-        items.append(item["_embedded"]["indexableObject"])
-else:
-    sys.exit(1)
-
-# Get link to next page of results
-url = r.json()["_embedded"]["searchResult"]["_links"]["next"]["href"]
-
-while True:
-    r = session.get(url)
-
-    # Parse this page of results
-    if r.ok:
-        for item in r.json()["_embedded"]["searchResult"]["_embedded"]["objects"]:
-            items.append(item["_embedded"]["indexableObject"])
-
-    # Try to set the URL for the next page
-    try:
-        url = r.json()["_embedded"]["searchResult"]["_links"]["next"]["href"]
-    except Exception:
-        break
+# prune old cache entries, at most once a day
+prune_cache(session.cache)
 
 fieldnames = [
     "Title",
@@ -74,140 +49,105 @@ fieldnames = [
     "Countries",
 ]
 
-with open("/tmp/cimmyt.csv", "w") as f:
+# CSV columns, the metadata fields they are extracted from, and whether we want
+# all of the unique values (joined with "; ") or just the first one. Where there are
+# several fields we use the first one that is present, in order of most likely
+# in CIMMYT's repository. For example, abstracts on Articles:
+#
+#   dc.description: 1512
+#   dc.description.abstract: 1261
+#   dcterms.description: 844
+#
+# and language:
+#
+#   dc.language: 2234
+#   dcterms.language: 870
+metadata_fields = [
+    ("Title", ("dc.title",), False),
+    ("Authors", ("dc.creator",), True),
+    (
+        "Abstract",
+        ("dc.description", "dc.description.abstract", "dcterms.description"),
+        False,
+    ),
+    ("Funders", ("dc.relation.funderName",), True),
+    ("Language", ("dc.language", "dcterms.language"), False),
+    ("DOI", ("dc.identifier.doi",), False),
+    ("Repository link", ("dc.identifier.uri",), False),
+    ("Publication date", ("dc.date.issued",), False),
+    ("Journal", ("dc.source.journal",), False),
+    ("ISSN", ("dc.source.issn",), False),
+    ("Publisher", ("dc.publisher", "dcterms.publisher"), False),
+    ("Pages", ("dc.description.pages",), False),
+]
+
+
+# Build a CSV row from an item's metadata
+def get_row(metadata: dict) -> dict:
+    row = {
+        column: (
+            "; ".join(dict.fromkeys(get_metadata_values(metadata, *fields)))
+            if multiple
+            else get_metadata_value(metadata, *fields)
+        )
+        for column, fields, multiple in metadata_fields
+    }
+
+    # Normalize some URIs since CIMMYT seems to have mixed HTTP/HTTPS
+    if row["Repository link"].startswith("http://hdl.handle.net"):
+        row["Repository link"] = "https" + row["Repository link"][4:]
+
+    # Append all subjects, lowercased and without duplicates
+    item_subjects = dict.fromkeys(
+        subject.lower()
+        for subject in get_metadata_values(
+            metadata, "dc.subject.agrovoc", "dc.subject.keywords"
+        )
+    )
+    row["Subjects"] = "; ".join(item_subjects)
+
+    item_countries = dict.fromkeys(
+        get_metadata_values(metadata, "dc.coverage.countryfocus")
+    )
+    row["Countries"] = "; ".join(item_countries)
+
+    return row
+
+
+url = "https://repository.cimmyt.org/server/api/discover/search/objects"
+params = {
+    "query": 'dc.date.issued:[2012 TO 2023] AND dc.type:Article AND (dc.title:"climate change" OR dc.subject.agrovoc:"climate change" OR dc.subject.keywords:"climate change" OR dc.description:"climate change" OR dc.description.abstract:"climate change" OR dcterms.description:"climate change") AND (dcterms.language:English OR dc.language:English)'
+}
+r = session.get(url, params=params)
+
+if not r.ok:
+    logger.error(f"Cannot retrieve search results: {r.url} ({r.status_code})")
+
+    sys.exit(1)
+
+# Write each page of results as we get it instead of collecting all the items
+# first, so we only ever hold one page in memory. Use a large write buffer.
+with open("/tmp/cimmyt.csv", "w", buffering=1 << 20, newline="") as f:
     writer = csv.DictWriter(f, fieldnames=fieldnames)
     writer.writeheader()
 
-    for item in items:
-        # All items should have titles right?
-        item_title = item["metadata"]["dc.title"][0]["value"]
-
-        item_authors = []
-        try:
-            for item_author in item["metadata"]["dc.creator"]:
-                item_authors.append(item_author["value"])
-        except KeyError:
-            pass
-
-        item_funders = []
-        try:
-            for item_funder in item["metadata"]["dc.relation.funderName"]:
-                item_funders.append(item_funder["value"])
-        except KeyError:
-            pass
-
-        # Get abstracts in order of most likelihood in CIMMYT's repository:
-        # dc.description: 1512
-        # dc.description.abstract: 1261
-        # dcterms.description: 844
-        try:
-            item_abstract = item["metadata"]["dc.description"][0]["value"]
-        except KeyError:
-            try:
-                item_abstract = item["metadata"]["dc.description.abstract"][0]["value"]
-            except KeyError:
-                try:
-                    item_abstract = item["metadata"]["dcterms.description"][0]["value"]
-                except KeyError:
-                    item_abstract = ""
-
-        try:
-            item_doi = item["metadata"]["dc.identifier.doi"][0]["value"]
-        except KeyError:
-            item_doi = ""
-
-        try:
-            item_handle = item["metadata"]["dc.identifier.uri"][0]["value"]
-
-            # Normalize some URIs since CIMMYT seems to have mixed HTTP/HTTPS
-            if "http://hdl.handle.net" in item_handle:
-                item_handle = item_handle.replace(
-                    "http://hdl.handle.net", "https://hdl.handle.net"
-                )
-        except KeyError:
-            item_handle = ""
-
-        try:
-            item_date_issued = item["metadata"]["dc.date.issued"][0]["value"]
-        except KeyError:
-            item_date_issued = ""
-
-        try:
-            item_journal = item["metadata"]["dc.source.journal"][0]["value"]
-        except KeyError:
-            item_journal = ""
-
-        try:
-            item_issn = item["metadata"]["dc.source.issn"][0]["value"]
-        except KeyError:
-            item_issn = ""
-
-        try:
-            item_publisher = item["metadata"]["dc.publisher"][0]["value"]
-        except KeyError:
-            try:
-                item_publisher = item["metadata"]["dcterms.publisher"][0]["value"]
-            except KeyError:
-                item_publisher = ""
-
-        try:
-            item_extent = item["metadata"]["dc.description.pages"][0]["value"]
-        except KeyError:
-            item_extent = ""
-
-        # Append all subjects
-        item_subjects = []
-        try:
-            for item_subject in item["metadata"]["dc.subject.agrovoc"]:
-                if item_subject["value"].lower() not in item_subjects:
-                    item_subjects.append(item_subject["value"].lower())
-        except KeyError:
-            pass
-
-        try:
-            for item_subject in item["metadata"]["dc.subject.keywords"]:
-                if item_subject["value"].lower() not in item_subjects:
-                    item_subjects.append(item_subject["value"].lower())
-        except KeyError:
-            pass
-
-        item_countries = []
-        try:
-            for item_country in item["metadata"]["dc.coverage.countryfocus"]:
-                if item_country["value"] not in item_countries:
-                    item_countries.append(item_country["value"])
-        except KeyError:
-            pass
-
-        # Get language in order of most likelihood in CIMMYT's repository. For
-        # Articles it seems they mostly use dc.language:
-        # dc.language: 2234
-        # dcterms.language: 870
-        try:
-            item_language = item["metadata"]["dc.language"][0]["value"]
-        except KeyError:
-            try:
-                item_language = item["metadata"]["dcterms.language"][0]["value"]
-            except KeyError:
-                item_language = ""
-
-        writer.writerow(
-            {
-                "Title": item_title,
-                "Authors": "; ".join(item_authors),
-                "Abstract": item_abstract,
-                "Language": item_language,
-                "DOI": item_doi,
-                "Repository link": item_handle,
-                "Publication date": item_date_issued,
-                "Journal": item_journal,
-                "ISSN": item_issn,
-                "Publisher": item_publisher,
-                "Pages": item_extent,
-                "Funders": "; ".join(item_funders),
-                "Subjects": "; ".join(item_subjects),
-                "Countries": "; ".join(item_countries),
-            }
+    while True:
+        search_result = r.json()["_embedded"]["searchResult"]
+
+        writer.writerows(
+            get_row(item["_embedded"]["indexableObject"]["metadata"])
+            for item in search_result["_embedded"]["objects"]
         )
 
+        # Get link to next page of results, which is missing on the last page
+        url = search_result["_links"].get("next", {}).get("href")
+
+        if not url:
+            break
+
+        r = session.get(url)
+
+        if not r.ok:
+            break
+
 logger.info("Wrote /tmp/cimmyt.csv")
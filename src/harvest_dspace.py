@@ -16,28 +16,43 @@
 #
 import argparse
 import csv
+import io
 import logging
 import re
 import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from xml.dom import minidom
+from functools import partial
+from xml.etree import ElementTree
 
 from packaging import version
+from requests.adapters import HTTPAdapter
 from requests_cache import CachedSession
 from tqdm import tqdm
 
-from util import detect_dspace_version
+from util import detect_dspace_version, prune_cache
 
 # Create a local logger instance
 logger = logging.getLogger(__name__)
 
+# Use write-ahead logging in the SQLite cache so threads reading responses from
+# the cache are not blocked while another thread is saving one
 session = CachedSession(
-    "harvest-cache", expire_after=timedelta(days=30), allowable_codes=(200, 404)
+    "harvest-cache",
+    backend="sqlite",
+    wal=True,
+    expire_after=timedelta(days=30),
+    allowable_codes=(200, 404),
 )
 
-# prune old cache entries
-session.cache.delete(expired=True)
+# prune old cache entries, at most once a day
+prune_cache(session.cache)
+
+# The total number of items in the pagination info on the Discover page
+pagination_pattern = re.compile(
+    r'<p class="pagination-info">Now showing items 1-10 of (\d+)</p>'
+)
 
 
 def signal_handler(signal, frame):
@@ -75,28 +90,77 @@ def parse_arguments():
         required=True,
         help="URL to DSpace root.",
     )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        help="Number of concurrent requests to make to the DSpace REST API.",
+        default=16,
+        type=int,
+    )
     args = parser.parse_args()
 
     return args
 
 
-# Returns a list of dicts
-def get_item_metadata(dspace_rest_api: str, handle: str) -> list:
+# Build a CSV row from an item's metadata with the user-specified fields. We
+# index the metadata by key first so each field is a single lookup instead of
+# a scan over all of the item's metadata. Join multiple values with "; ".
+def get_row(item_metadata_json: list, fields: tuple) -> dict:
+    index = {}
+
+    for metadatum in item_metadata_json:
+        index.setdefault(metadatum["key"], []).append(metadatum["value"])
+
+    return {field: "; ".join(index.get(field, ())) for field in fields}
+
+
+# Look up a handle using the undocumented "handle" REST API endpoint and return
+# a CSV row for it, or None if the handle is not an item we can access. We ask
+# for the metadata up front so we only need one request per handle.
+def harvest_handle(dspace_rest_api: str, fields: tuple, handle: str) -> dict | None:
+    logger.debug(f"Looking up {handle}")
     r = session.get(f"{dspace_rest_api}/handle/{handle}", params={"expand": "metadata"})
 
-    return r.json()["metadata"]
+    # Skip this handle if status is not OK. Could be a restricted
+    # community, collection, or item.
+    if not r.ok:
+        logger.debug(f"> Skipping {r.url} ({r.status_code})")
+
+        return None
+
+    data = r.json()
+
+    if not data["type"] == "item":
+        logger.debug(f"> Skipping {data['type']}")
+
+        return None
+
+    return get_row(data["metadata"], fields)
+
+
+# Yield the URLs in the <loc> elements of a sitemap or sitemap index. We stream
+# the XML and clear elements as we go instead of building the whole document,
+# as sitemaps can list 50,000 URLs. The elements are in the sitemaps.org XML
+# namespace so we only compare the local part of the tag.
+def get_sitemap_locations(sitemap: bytes):
+    for _, element in ElementTree.iterparse(io.BytesIO(sitemap)):
+        if element.tag.rpartition("}")[2] == "loc":
+            yield element.text
+
+        element.clear()
 
 
 # For DSpace 5.10+ we retrieve all the Handles from the sitemap and then request
-# them one by one from the /rest/handle endpoint.
+# them from the /rest/handle endpoint using a pool of threads. Rows are written
+# in sitemap order as the results come back.
 def parse_sitemap(dspace_sitemap: str, dspace_rest_api: str):
-    # Write the CSV header based on the user's list of metadata fields
-    writer = csv.DictWriter(args.output_file, fieldnames=args.fields.split(","))
+    # Split the user's list of metadata fields once and write the CSV header
+    fields = tuple(args.fields.split(","))
+    writer = csv.DictWriter(args.output_file, fieldnames=fields)
     writer.writeheader()
 
     # Get the main XML sitemap
     r = session.get(dspace_sitemap)
-    sitemap_root = minidom.parseString(r.content)
 
     # Get the locations of the child sitemaps, ie:
     #
@@ -108,53 +172,62 @@ def parse_sitemap(dspace_sitemap: str, dspace_rest_api: str):
     #   </sitemapindex>
     #
     # There can be more than one sitemap, as they are split at about 50,000 items
-    for sitemap in sitemap_root.getElementsByTagName("loc"):
-        sitemap_loc = sitemap.firstChild.nodeValue
-        sitemap_loc_root = minidom.parseString(session.get(sitemap_loc).content)
+    for sitemap_loc in get_sitemap_locations(r.content):
+        sitemap_loc_content = session.get(sitemap_loc).content
 
-        # Get the URLs of handles in this child sitemap, splitting the URL
+        # Get the URLs of handles in this child sitemap, partitioning the URL
         # so we can get just the handle component for each item, ie:
         #
-        #   ['https://dspacetest.cgiar.org/', '10568/43178']
+        #   ('https://dspacetest.cgiar.org/', 'handle/', '10568/43178')
         #
         handles = [
-            handle_loc.firstChild.nodeValue.split("handle/")[1]
-            for handle_loc in sitemap_loc_root.getElementsByTagName("loc")
+            handle_loc.rpartition("handle/")[2]
+            for handle_loc in get_sitemap_locations(sitemap_loc_content)
         ]
 
-        for handle in tqdm(handles, desc="Harvesting"):
-            logger.debug(f"Looking up {handle}")
-            # Relying on undocumented "handle" REST API endpoint
-            r = session.get(f"{dspace_rest_api}/handle/{handle}")
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            rows = executor.map(
+                partial(harvest_handle, dspace_rest_api, fields), handles
+            )
 
-            # Skip this handle if status is not OK. Could be a restricted
-            # community, collection, or item.
-            if not r.ok:
-                logger.debug(f"> Skipping {r.url} ({r.status_code})")
+            for row in tqdm(rows, total=len(handles), desc="Harvesting"):
+                if row:
+                    writer.writerow(row)
 
-                continue
 
-            if not r.json()["type"] == "item":
-                logger.debug(f"> Skipping {r.json()['type']}")
+# Look up the item at this offset in the /rest/items endpoint and return a CSV
+# row for it, or None if the page is empty or the item is not accessible.
+def harvest_offset(dspace_rest_api: str, fields: tuple, offset: int) -> dict | None:
+    params = {"limit": 1, "offset": offset}
+    logger.info(f"Checking page {offset}")
 
-                continue
+    r = session.get(f"{dspace_rest_api}/items", params=params)
+
+    if not r.ok:
+        logger.debug(f"> Skipping {r.url} ({r.status_code})")
 
-            item_metadata_json = get_item_metadata(dspace_rest_api, handle)
+        return None
 
-            # Initialize empty dict
-            row = dict()
+    # Some pages are blank :)
+    try:
+        item = r.json()[0]
+    except IndexError:
+        logger.debug(f"> Skipping empty {r.url}")
 
-            # Iterate over user-specified fields and extract matching metadata
-            # from the item. Join multiple values with "; ".
-            for field in args.fields.split(","):
-                metadatum = [
-                    metadatum["value"]
-                    for metadatum in item_metadata_json
-                    if metadatum["key"] == field
-                ]
-                row[field] = "; ".join(metadatum)
+        return None
 
-            writer.writerow(row)
+    handle = item["handle"]
+    item_id = item["id"]
+
+    logger.info(f"> Looking up {handle} (id: {item_id})")
+    r = session.get(f"{dspace_rest_api}/items/{item_id}", params={"expand": "metadata"})
+
+    if not r.ok:
+        logger.debug(f"> Skipping {r.url} ({r.status_code})")
+
+        return None
+
+    return get_row(r.json()["metadata"], fields)
 
 
 # DSpace 5.4's REST API has numerous problems:
@@ -164,8 +237,9 @@ def parse_sitemap(dspace_sitemap: str, dspace_rest_api: str):
 #
 # We must blindly iterate over all items and guess when we are done.
 def iterate_items(dspace_root: str, dspace_rest_api: str):
-    # Write the CSV header based on the user's list of metadata fields
-    writer = csv.DictWriter(args.output_file, fieldnames=args.fields.split(","))
+    # Split the user's list of metadata fields once and write the CSV header
+    fields = tuple(args.fields.split(","))
+    writer = csv.DictWriter(args.output_file, fieldnames=fields)
     writer.writeheader()
 
     r = session.get(f"{dspace_root}/discover", headers={"Accept-Language": "en"})
@@ -175,60 +249,21 @@ def iterate_items(dspace_root: str, dspace_rest_api: str):
 
         sys.exit(1)
 
-    pagination = re.findall(
-        r'<p class="pagination-info">Now showing items 1-10 of \d+</p>', r.text
-    )[0]
-    discover_results = re.search(r"\d{3,}", pagination).group(0)
+    discover_results = pagination_pattern.search(r.text).group(1)
     # round the Discover results up to the nearest 1000
     num_items_estimate = round(int(discover_results), -3)
 
-    for offset in range(0, num_items_estimate):
-        params = {"limit": 1, "offset": offset}
-        logger.info(f"Checking page {offset}")
-
-        r = session.get(f"{dspace_rest_api}/items", params=params)
-
-        if not r.ok:
-            logger.debug(f"> Skipping {r.url} ({r.status_code})")
-
-            continue
-
-        # Some pages are blank :)
-        try:
-            handle = r.json()[0]["handle"]
-        except IndexError:
-            logger.debug(f"> Skipping empty {r.url}")
-
-            continue
-
-        item_id = r.json()[0]["id"]
-
-        logger.info(f"> Looking up {handle} (id: {item_id})")
-        r = session.get(
-            f"{dspace_rest_api}/items/{item_id}", params={"expand": "metadata"}
+    # Fetch the offsets concurrently, but write the rows from this thread in
+    # offset order so we only ever have one thread using the CSV writer.
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        rows = executor.map(
+            partial(harvest_offset, dspace_rest_api, fields),
+            range(0, num_items_estimate),
         )
 
-        if not r.ok:
-            logger.debug(f"> Skipping {r.url} ({r.status_code})")
-
-            continue
-
-        item_metadata_json = r.json()["metadata"]
-
-        # Initialize empty dict
-        row = dict()
-
-        # Iterate over user-specified fields and extract matching metadata
-        # from the item. Join multiple values with "; ".
-        for field in args.fields.split(","):
-            metadatum = [
-                metadatum["value"]
-                for metadatum in item_metadata_json
-                if metadatum["key"] == field
-            ]
-            row[field] = "; ".join(metadatum)
-
-        writer.writerow(row)
+        for row in rows:
+            if row:
+                writer.writerow(row)
 
 
 def main(args):
@@ -236,6 +271,13 @@ def main(args):
     dspace_sitemap = f"{dspace_root}/sitemap"
     dspace_rest_api = f"{dspace_root}/rest"
 
+    # Keep one pooled connection per worker thread alive so concurrent requests
+    # to the repository reuse connections instead of doing new TLS handshakes.
+    # The default pool of ten connections is smaller than our default threads.
+    adapter = HTTPAdapter(pool_maxsize=args.threads)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
     dspace_version = detect_dspace_version(dspace_root)
 
     # Trim -SNAPSHOT if it exists because Python's version parse doesn't support
@@ -7,12 +7,14 @@ import csv
 import logging
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
+from requests.adapters import HTTPAdapter
 from requests_cache import CachedSession
 from tqdm import tqdm
 
-from util import clean_string, normalize_doi
+from util import clean_string, normalize_doi, prune_cache
 
 # Create a local logger instance for this module. We don't do any configuration
 # because this module might be used elsewhere that will have its own logging
@@ -21,12 +23,27 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logging.basicConfig(format="%(message)s")
 
+# Use write-ahead logging in the SQLite cache so threads reading responses from
+# the cache are not blocked while another thread is saving one
 session = CachedSession(
-    "harvest-cache", expire_after=timedelta(days=30), allowable_codes=(200, 404)
+    "harvest-cache",
+    backend="sqlite",
+    wal=True,
+    expire_after=timedelta(days=30),
+    allowable_codes=(200, 404),
 )
 
-# prune old cache entries
-session.cache.delete(expired=True)
+# prune old cache entries, at most once a day
+prune_cache(session.cache)
+
+# Number of records to fetch concurrently. Keep one pooled connection alive for
+# each worker so they don't have to do new TLS handshakes.
+workers = 32
+session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+
+# CONTENTdm prefixes funder names with their Crossref Funder Registry DOI, for
+# example: "http://dx.doi.org/10.13039/501100000780 European Commission"
+funder_doi_pattern = re.compile(r"http://dx\.doi\.org/10\.13039/\d+ ")
 
 # IFPRI CONTENTdm API base URL
 url = "https://ebrary.ifpri.org/digital/bl/dmwebservices/index.php"
@@ -48,12 +65,16 @@ r = session.get(url, params=params)
 
 # Find out how many records matched and get the first ten
 if r.ok:
-    pager_start = int(r.json()["pager"]["start"])
-    pager_total = int(r.json()["pager"]["total"])
+    data = r.json()
+
+    pager_start = int(data["pager"]["start"])
+    pager_total = int(data["pager"]["total"])
 
-    record_pointers = [record["pointer"] for record in r.json()["records"]]
+    record_pointers = [record["pointer"] for record in data["records"]]
 else:
-    sys.exit()
+    logger.error(f"Cannot retrieve search results: {r.url} ({r.status_code})")
+
+    sys.exit(1)
 
 while True:
     # Get the next ten records
@@ -64,13 +85,38 @@ while True:
     r = session.get(url, params=params)
 
     # Parse this page of results
-    if r.ok:
-        for record in r.json()["records"]:
-            record_pointers.append(record["pointer"])
+    if not r.ok:
+        break
+
+    records = r.json()["records"]
+    record_pointers.extend(record["pointer"] for record in records)
 
-    if len(r.json()["records"]) < 10:
+    # The last page has fewer than ten records
+    if len(records) < 10:
         break
 
+
+def get_record(record_pointer: str) -> dict | None:
+    params = {"q": f"dmGetItemInfo/p15738coll5/{record_pointer}/json"}
+    r = session.get(url, params=params)
+
+    if r.ok:
+        return r.json()
+    else:
+        return None
+
+
+# Fetch the records concurrently since each one is a separate request. The
+# results come back in the same order as the pointers.
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    records = list(
+        tqdm(
+            executor.map(get_record, record_pointers),
+            total=len(record_pointers),
+            desc="Harvesting",
+        )
+    )
+
 fieldnames = [
     "Title",
     "Authors",
@@ -90,17 +136,15 @@ fieldnames = [
     "Type",
 ]
 
-with open("/tmp/ifpri.csv", "w") as f:
+# Use a large write buffer and collect the rows so we can write them in one go
+with open("/tmp/ifpri.csv", "w", buffering=1 << 20, newline="") as f:
     writer = csv.DictWriter(f, fieldnames=fieldnames)
     writer.writeheader()
 
-    for record_pointer in tqdm(record_pointers, desc="Harvesting"):
-        params = {"q": f"dmGetItemInfo/p15738coll5/{record_pointer}/json"}
-        r = session.get(url, params=params)
+    rows = []
 
-        if r.ok:
-            record = r.json()
-        else:
+    for record_pointer, record in zip(record_pointers, records):
+        if record is None:
             continue
 
         # All items should have titles right?
@@ -116,9 +160,7 @@ with open("/tmp/ifpri.csv", "w") as f:
         item_authors = record["creato"]
 
         if isinstance(record["fundin"], str):
-            item_funders = re.sub(
-                r"http://dx.doi.org/10.13039/\d+ ", "", record["fundin"]
-            )
+            item_funders = funder_doi_pattern.sub("", record["fundin"])
         else:
             item_funders = ""
 
@@ -173,22 +215,19 @@ with open("/tmp/ifpri.csv", "w") as f:
             item_extent = ""
 
         # Lazily combine all subjects. CONTENTdm seems to have a mix of strings
-        # and dicts, and some with extra semicolons...
-        if isinstance(record["loc"], dict):
-            item_subjects = "; ".join(record["loc"])
-        else:
-            item_subjects = record["loc"].rstrip("; ")
-
-        if isinstance(record["subjea"], dict):
-            item_subjects = item_subjects + "; ".join(record["subjea"])
-        else:
-            item_subjects = item_subjects + "; " + record["subjea"]
+        # and dicts (empty when there are no values), and some with extra
+        # semicolons... Lowercase each part once before joining them.
+        item_subjects = [
+            record[field].rstrip("; ").lower()
+            for field in ("loc", "subjea")
+            if isinstance(record[field], str)
+        ]
 
         item_language = record["langua"]
 
         item_type = record["type"]
 
-        writer.writerow(
+        rows.append(
             {
                 "Title": item_title,
                 "Authors": item_authors,
@@ -204,9 +243,11 @@ with open("/tmp/ifpri.csv", "w") as f:
                 "Publisher": item_publisher,
                 "Pages": item_extent,
                 "Funders": item_funders,
-                "Subjects": item_subjects.rstrip("; ").lower(),
+                "Subjects": "; ".join(item_subjects),
                 "Type": item_type,
             }
         )
 
+    writer.writerows(rows)
+
 logger.info("Wrote /tmp/ifpri.csv")
@@ -6,10 +6,15 @@
 import csv
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from itertools import chain
 
+from requests.adapters import HTTPAdapter
 from requests_cache import CachedSession
 
+from util import get_metadata_value, get_metadata_values, prune_cache
+
 # Create a local logger instance for this module. We don't do any configuration
 # because this module might be used elsewhere that will have its own logging
 # configuration.
@@ -17,44 +22,23 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logging.basicConfig(format="%(message)s")
 
+# Use write-ahead logging in the SQLite cache so threads reading responses from
+# the cache are not blocked while another thread is saving one
 session = CachedSession(
-    "harvest-cache", expire_after=timedelta(days=30), allowable_codes=(200, 404)
+    "harvest-cache",
+    backend="sqlite",
+    wal=True,
+    expire_after=timedelta(days=30),
+    allowable_codes=(200, 404),
 )
 
-# prune old cache entries
-session.cache.delete(expired=True)
-
-url = "https://repo.mel.cgiar.org/server/api/discover/search/objects"
-params = {
-    "query": '(dcterms.issued:[2012 TO 2023] OR dcterms.available:[2012 TO 2023]) AND dc.type:"Journal Article" AND (dc.title:"climate change" OR dc.subject:"climate change" OR cg.subject.agrovoc:"climate change" OR dc.description.abstract:"climate change") AND dc.language:en'
-}
-r = session.get(url, params=params)
-
-# Create empty list for items
-items = []
-
-if r.ok:
-    for item in r.json()["_embedded"]["searchResult"]["_embedded"]["objects"]:
-        items.append(item["_embedded"]["indexableObject"])
-else:
-    sys.exit(1)
-
-# Get link to next page of results
-url = r.json()["_embedded"]["searchResult"]["_links"]["next"]["href"]
+# prune old cache entries, at most once a day
+prune_cache(session.cache)
 
-while True:
-    r = session.get(url)
-
-    # Parse this page of results
-    if r.ok:
-        for item in r.json()["_embedded"]["searchResult"]["_embedded"]["objects"]:
-            items.append(item["_embedded"]["indexableObject"])
-
-    # Try to set the URL for the next page
-    try:
-        url = r.json()["_embedded"]["searchResult"]["_links"]["next"]["href"]
-    except Exception:
-        break
+# Number of result pages to fetch concurrently. Keep one pooled connection alive
+# for each worker so they don't have to do new TLS handshakes.
+workers = 8
+session.mount("https://", HTTPAdapter(pool_maxsize=workers))
 
 fieldnames = [
     "Title",
@@ -79,164 +63,108 @@ fieldnames = [
     "Countries",
 ]
 
-with open("/tmp/melspace.csv", "w") as f:
+# CSV columns, the metadata fields they are extracted from, and whether we want
+# all of the unique values (joined with "; ") or just the first one. MELSpace
+# uses dc.creator as the first author, and dc.contributor for the other authors.
+metadata_fields = [
+    ("Title", ("dc.title",), False),
+    ("Authors", ("dc.creator", "dc.contributor"), True),
+    ("Author affiliations", ("cg.contributor.center",), True),
+    ("Abstract", ("dc.description.abstract",), False),
+    ("Language", ("dc.language",), False),
+    ("DOI", ("cg.identifier.doi",), False),
+    ("Access rights", ("dc.identifier.status",), False),
+    ("Usage rights", ("dc.rights",), False),
+    ("Repository link", ("dc.identifier.uri",), False),
+    ("Publication date", ("dcterms.issued",), False),
+    ("Publication date (Online)", ("dcterms.available",), False),
+    ("Journal", ("cg.journal",), False),
+    ("ISSN", ("cg.issn",), False),
+    ("Publisher", ("dc.publisher",), False),
+    ("Volume", ("cg.volume",), False),
+    ("Issue", ("cg.issue",), False),
+    ("Pages", ("dcterms.extent",), False),
+    ("Countries", ("cg.coverage.country",), True),
+]
+
+
+# Build a CSV row from an item's metadata
+def get_row(metadata: dict) -> dict:
+    row = {
+        column: (
+            "; ".join(dict.fromkeys(get_metadata_values(metadata, *fields)))
+            if multiple
+            else get_metadata_value(metadata, *fields)
+        )
+        for column, fields, multiple in metadata_fields
+    }
+
+    # MELSpace insists on this, but it adds no value
+    item_funders = [
+        funder
+        for funder in get_metadata_values(metadata, "cg.contributor.funder")
+        if funder != "Not Applicable"
+    ]
+    row["Funders"] = "; ".join(item_funders)
+
+    # Append all subjects, first AGROVOC, then other subjects, lowercased and
+    # without duplicates
+    item_subjects = dict.fromkeys(
+        subject.lower()
+        for subject in get_metadata_values(metadata, "cg.subject.agrovoc", "dc.subject")
+    )
+    row["Subjects"] = "; ".join(item_subjects)
+
+    return row
+
+
+url = "https://repo.mel.cgiar.org/server/api/discover/search/objects"
+params = {
+    "query": '(dcterms.issued:[2012 TO 2023] OR dcterms.available:[2012 TO 2023]) AND dc.type:"Journal Article" AND (dc.title:"climate change" OR dc.subject:"climate change" OR cg.subject.agrovoc:"climate change" OR dc.description.abstract:"climate change") AND dc.language:en'
+}
+
+
+def get_page(page: int) -> dict | None:
+    r = session.get(url, params={**params, "page": page})
+
+    if r.ok:
+        return r.json()
+    else:
+        return None
+
+
+r = session.get(url, params=params)
+
+if not r.ok:
+    logger.error(f"Cannot retrieve search results: {r.url} ({r.status_code})")
+
+    sys.exit(1)
+
+# Parse the first page once and reuse it below
+data = r.json()
+
+# The first page tells us how many pages there are, so we can request the rest
+# concurrently by page number instead of following the "next" links one by one.
+# The results come back in page order.
+total_pages = data["_embedded"]["searchResult"]["page"]["totalPages"]
+
+# Write each page of results as we get it instead of collecting all the items
+# first. Use a large write buffer.
+with open("/tmp/melspace.csv", "w", buffering=1 << 20, newline="") as f:
     writer = csv.DictWriter(f, fieldnames=fieldnames)
     writer.writeheader()
 
-    for item in items:
-        # All items should have titles right?
-        item_title = item["metadata"]["dc.title"][0]["value"]
-
-        # Concatenate authors. MELSpace uses dc.creator as the first author, and
-        # dc.contributor for the other authors.
-        item_authors = []
-        try:
-            for item_author in item["metadata"]["dc.creator"]:
-                item_authors.append(item_author["value"])
-        except KeyError:
-            pass
-
-        try:
-            for item_author in item["metadata"]["dc.contributor"]:
-                item_authors.append(item_author["value"])
-        except KeyError:
-            pass
-
-        item_affiliations = []
-        try:
-            for item_affiliation in item["metadata"]["cg.contributor.center"]:
-                item_affiliations.append(item_affiliation["value"])
-        except KeyError:
-            pass
-
-        item_funders = []
-        try:
-            for item_funder in item["metadata"]["cg.contributor.funder"]:
-                # MELSpace insists on this, but it adds no value
-                if item_funder["value"] == "Not Applicable":
-                    pass
-                else:
-                    item_funders.append(item_funder["value"])
-        except KeyError:
-            pass
-
-        try:
-            item_abstract = item["metadata"]["dc.description.abstract"][0]["value"]
-        except KeyError:
-            item_abstract = ""
-
-        try:
-            item_doi = item["metadata"]["cg.identifier.doi"][0]["value"]
-        except KeyError:
-            item_doi = ""
-
-        try:
-            item_access_rights = item["metadata"]["dc.identifier.status"][0]["value"]
-        except KeyError:
-            item_access_rights = ""
-
-        try:
-            item_usage_rights = item["metadata"]["dc.rights"][0]["value"]
-        except KeyError:
-            item_usage_rights = ""
-
-        try:
-            item_handle = item["metadata"]["dc.identifier.uri"][0]["value"]
-        except KeyError:
-            item_handle = ""
-
-        try:
-            item_date_issued = item["metadata"]["dcterms.issued"][0]["value"]
-        except KeyError:
-            item_date_issued = ""
-
-        try:
-            item_date_online = item["metadata"]["dcterms.available"][0]["value"]
-        except KeyError:
-            item_date_online = ""
-
-        try:
-            item_journal = item["metadata"]["cg.journal"][0]["value"]
-        except KeyError:
-            item_journal = ""
-
-        try:
-            item_issn = item["metadata"]["cg.issn"][0]["value"]
-        except KeyError:
-            item_issn = ""
-
-        try:
-            item_publisher = item["metadata"]["dc.publisher"][0]["value"]
-        except KeyError:
-            item_publisher = ""
-
-        try:
-            item_volume = item["metadata"]["cg.volume"][0]["value"]
-        except KeyError:
-            item_volume = ""
-
-        try:
-            item_issue = item["metadata"]["cg.issue"][0]["value"]
-        except KeyError:
-            item_issue = ""
-
-        try:
-            item_extent = item["metadata"]["dcterms.extent"][0]["value"]
-        except KeyError:
-            item_extent = ""
-
-        # Append all subjects, first AGROVOC, then other subjects
-        item_subjects = []
-        try:
-            for item_subject in item["metadata"]["cg.subject.agrovoc"]:
-                if item_subject["value"].lower() not in item_subjects:
-                    item_subjects.append(item_subject["value"].lower())
-        except KeyError:
-            pass
-
-        try:
-            for item_subject in item["metadata"]["dc.subject"]:
-                if item_subject["value"].lower() not in item_subjects:
-                    item_subjects.append(item_subject["value"].lower())
-        except KeyError:
-            pass
-
-        item_countries = []
-        try:
-            for item_country in item["metadata"]["cg.coverage.country"]:
-                if item_country["value"] not in item_countries:
-                    item_countries.append(item_country["value"])
-        except KeyError:
-            pass
-
-        try:
-            item_language = item["metadata"]["dc.language"][0]["value"]
-        except KeyError:
-            item_language = ""
-
-        writer.writerow(
-            {
-                "Title": item_title,
-                "Authors": "; ".join(item_authors),
-                "Author affiliations": "; ".join(item_affiliations),
-                "Abstract": item_abstract,
-                "Language": item_language,
-                "DOI": item_doi,
-                "Access rights": item_access_rights,
-                "Usage rights": item_usage_rights,
-                "Repository link": item_handle,
-                "Publication date": item_date_issued,
-                "Publication date (Online)": item_date_online,
-                "Journal": item_journal,
-                "ISSN": item_issn,
-                "Publisher": item_publisher,
-                "Volume": item_volume,
-                "Issue": item_issue,
-                "Pages": item_extent,
-                "Funders": "; ".join(item_funders),
-                "Subjects": "; ".join(item_subjects),
-                "Countries": "; ".join(item_countries),
-            }
-        )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = executor.map(get_page, range(1, total_pages))
+
+        for data in chain([data], pages):
+            # Stop at the first page that failed
+            if data is None:
+                break
+
+            writer.writerows(
+                get_row(item["_embedded"]["indexableObject"]["metadata"])
+                for item in data["_embedded"]["searchResult"]["_embedded"]["objects"]
+            )
 
 logger.info("Wrote /tmp/melspace.csv")
@@ -15,6 +15,7 @@
 import csv
 import json
 import logging
+import re
 
 from util import clean_string, normalize_doi
 
@@ -23,169 +24,127 @@ logger.setLevel(logging.INFO)
 logging.basicConfig(format="%(message)s")
 
 
-def export_row(row):
-    try:
-        title = clean_string(row["title"])
-    except KeyError:
-        title = None
-
-    authors = list()
-    try:
-        for author in row["creators"]:
-            # The family or given name for this author may be blank
-            try:
-                family_name = author["name"]["family"]
-                given_name = author["name"]["given"]
-                author_name = f"{family_name}, {given_name}"
-
-                if author_name not in authors:
-                    authors.append(author_name)
-            except KeyError:
-                continue
-    except KeyError:
-        authors = None
-
-    affiliations = list()
-    try:
-        for affiliation in row["affiliation"]:
-            if affiliation not in affiliations:
-                affiliations.append(affiliation)
-    except KeyError:
-        affiliations = ""
-
-    funders = list()
-    try:
-        for funder in row["funders"]:
-            if funder not in funders:
-                funders.append(funder)
-    except KeyError:
-        funders = ""
-
-    try:
-        abstract = row["abstract"]
-    except KeyError:
-        abstract = None
-
-    try:
-        # Make sure this is something like a DOI or a URL...
-        if "http" in row["id_number"] or "10." in row["id_number"]:
-            doi = normalize_doi(row["id_number"])
-        else:
-            doi = None
-    except KeyError:
+# Yield the objects in a top-level JSON array one at a time, reading the file in
+# chunks so we never have the whole export in memory. We decode each object in
+# place and only trim the buffer when we need to read the next chunk.
+def iterate_json_array(f, chunk_size: int = 1 << 20):
+    decoder = json.JSONDecoder()
+    separator = re.compile(r"[\s,]*")
+    buffer = f.read(chunk_size).lstrip()
+
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+
+    position = 1
+
+    while True:
+        position = separator.match(buffer, position).end()
+
+        if buffer.startswith("]", position):
+            return
+
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The object is incomplete, so read the next chunk and try again
+            chunk = f.read(chunk_size)
+
+            if not chunk:
+                raise
+
+            buffer = buffer[position:] + chunk
+            position = 0
+
+            continue
+
+        yield item
+
+
+# CSV columns and the EPrints fields that are copied to them as they are
+eprints_fields = [
+    ("Abstract", "abstract"),
+    ("Repository link", "uri"),
+    ("Publication date", "date"),
+    ("Journal", "publication"),
+    ("ISSN", "issn"),
+    ("Publisher", "publisher"),
+    ("Volume", "volume"),
+    ("Issue", "number"),
+    ("Pages", "pagerange"),
+]
+
+
+# EPrints keywords are separated by commas or semicolons
+keyword_separator_pattern = re.compile(r"[,;]")
+
+
+# Build a CSV row from an EPrints record
+def get_row(row: dict) -> dict:
+    csv_row = {column: row.get(field, "") for column, field in eprints_fields}
+
+    if "title" in row:
+        csv_row["Title"] = clean_string(row["title"])
+
+    # Use dicts to drop duplicate values while keeping them in order. The family
+    # or given name for an author may be blank.
+    authors = dict.fromkeys(
+        f"{author['name']['family']}, {author['name']['given']}"
+        for author in row.get("creators", ())
+        if "family" in author.get("name", {}) and "given" in author["name"]
+    )
+    affiliations = dict.fromkeys(row.get("affiliation", ()))
+    funders = dict.fromkeys(row.get("funders", ()))
+
+    # Make sure this is something like a DOI or a URL...
+    id_number = row.get("id_number", "")
+    if "http" in id_number or "10." in id_number:
+        doi = normalize_doi(id_number)
+    else:
         doi = None
 
     # Try to capture the official_url as the DOI if we don't have a DOI already.
-    # We have to try/except here because not all items have official_url.
-    try:
-        if not doi and len(row["official_url"]) > 0:
-            doi = normalize_doi(row["official_url"])
-    except KeyError:
-        pass
-
-    # Repository URI
-    try:
-        uri = row["uri"]
-    except KeyError:
-        uri = None
-
-    try:
-        date = row["date"]
-    except KeyError:
-        date = None
-
-    try:
-        publication = row["publication"]
-    except KeyError:
-        publication = None
-
-    try:
-        issn = row["issn"]
-    except KeyError:
-        issn = None
-
-    try:
-        publisher = row["publisher"]
-    except KeyError:
-        publisher = None
-
-    try:
-        volume = row["volume"]
-    except KeyError:
-        volume = None
-
-    try:
-        issue = row["number"]
-    except KeyError:
-        issue = None
+    # Not all items have official_url.
+    if not doi and row.get("official_url"):
+        doi = normalize_doi(row["official_url"])
 
     # Extract keywords as subjects for now. In EPrints they are apparently one
     # long string, and I see a lot of "\r\n" and whitespace in them so we need
     # to split and clean them.
-    subjects = list()
-    try:
+    subjects = dict()
+    if "keywords" in row:
         # Oh my gosh, there are keyword strings separating multiple values with
-        # semi-colons!
-        row["keywords"] = row["keywords"].replace(";", ",")
-
-        for subject in row["keywords"].lower().split(","):
-            if clean_string(subject) not in subjects:
-                subjects.append(clean_string(subject))
-    except KeyError:
-        # Use an empty list here so we can append later
-        subjects = list()
-
-    try:
-        extent = row["pagerange"]
-    except KeyError:
-        extent = ""
-
-    try:
-        countries = row["country"]
-    except KeyError:
-        countries = ""
+        # semi-colons! Split on both in one pass over the lowercased string.
+        subjects = dict.fromkeys(
+            clean_string(subject)
+            for subject in keyword_separator_pattern.split(row["keywords"].lower())
+        )
 
     # Append "climate change" to subjects if we see the corresponding code.
     # I want to make sure this is here so that we don't wonder why an item
     # has matched later
-    if "s2.8" in row["subjects"] and "climate change" not in subjects:
-        if len(subjects) > 0:
-            subjects.append("climate change")
-        else:
-            subjects.append("climate change")
-
-    writer.writerow(
-        {
-            "Title": title,
-            "Authors": "; ".join(authors),
-            "Author affiliations": "; ".join(affiliations),
-            "Abstract": abstract,
-            "DOI": doi,
-            "Repository link": uri,
-            "Publication date": date,
-            "Journal": publication,
-            "ISSN": issn,
-            "Publisher": publisher,
-            "Volume": volume,
-            "Issue": issue,
-            "Subjects": "; ".join(subjects),
-            "Funders": "; ".join(funders),
-            "Pages": extent,
-            "Countries": "; ".join(countries),
-        }
-    )
+    if "s2.8" in row.get("subjects", ()):
+        subjects.setdefault("climate change")
+
+    csv_row["Authors"] = "; ".join(authors)
+    csv_row["Author affiliations"] = "; ".join(affiliations)
+    csv_row["DOI"] = doi
+    csv_row["Subjects"] = "; ".join(subjects)
+    csv_row["Funders"] = "; ".join(funders)
+    csv_row["Countries"] = "; ".join(row.get("country", ()))
+
+    return csv_row
 
 
 input_file = "/tmp/icrisat.json"
 output_file = "data/icrisat-filtered.csv"
 
-with open(input_file, "r") as f:
-    icrisat_json = json.load(f)
-    logger.info(f"Opened {input_file}")
+# Stream the records instead of loading the whole JSON document into memory
+input_file_handle = open(input_file, "r")
+icrisat_json = iterate_json_array(input_file_handle)
+logger.info(f"Opened {input_file}")
 
-# Open the output file and keep it open so we can use the CSV writer in
-# the export_row function
-output_file_handle = open(output_file, "w")
+# Open the output file with a large write buffer
+output_file_handle = open(output_file, "w", buffering=1 << 20, newline="")
 
 fieldnames = [
     "Title",
@@ -207,38 +166,29 @@ fieldnames = [
 ]
 writer = csv.DictWriter(output_file_handle, fieldnames=fieldnames)
 writer.writeheader()
+rows = []
 logger.info(f"Wrote {output_file}")
 
-# Iterate over rows looking for matches of "climate change" in the title and
-# subjects
+# Match "climate change" in any case in the free text fields
+climate_change_pattern = re.compile(r"climate change", re.IGNORECASE)
+
+# Iterate over rows looking for matches of "climate change" in the title,
+# keywords, and abstract, or for the climate change code in the subjects. We
+# search the text fields in one pass instead of lowercasing each of them.
 for row in icrisat_json:
-    try:
-        if "climate change" in row["title"].lower():
-            export_row(row)
-            continue
-    except KeyError:
-        pass
+    text = "\n".join(row.get(field, "") for field in ("title", "keywords", "abstract"))
 
-    try:
-        # s2.8 is the code for "climate change" in the controlled subjects
-        if "s2.8" in row["subjects"]:
-            export_row(row)
-            continue
-    except KeyError:
-        pass
+    # s2.8 is the code for "climate change" in the controlled subjects
+    if "s2.8" in row.get("subjects", ()) or climate_change_pattern.search(text):
+        rows.append(get_row(row))
 
-    try:
-        if "climate change" in row["keywords"].lower():
-            export_row(row)
-            continue
-    except KeyError:
-        pass
+        # Write the rows in batches
+        if len(rows) >= 1000:
+            writer.writerows(rows)
+            rows.clear()
 
-    try:
-        if "climate change" in row["abstract"].lower():
-            export_row(row)
-            continue
-    except KeyError:
-        pass
+# Write the last batch of rows
+writer.writerows(rows)
 
+input_file_handle.close()
 output_file_handle.close()
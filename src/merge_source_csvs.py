@@ -6,7 +6,7 @@
 #
 
 import logging
-import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 
@@ -21,124 +21,143 @@ pd.options.mode.copy_on_write = True
 
 # Read all source CSVs into data frames. Use categorical dtype for some fields
 # that have a limited number of values. Use the pyarrow dtype backend because
-# pyarrow dtypes use significantly less memory than pandas default dtypes.
-df_cgspace = pd.read_csv(
-    "data/cgspace-filtered.csv",
-    dtype={"Access rights": "category", "Usage rights": "category"},
-    dtype_backend="pyarrow",
-)
-df_melspace = pd.read_csv(
-    "data/melspace-filtered.csv",
-    dtype={"Access rights": "category", "Usage rights": "category"},
-    dtype_backend="pyarrow",
-)
-df_worldfish = pd.read_csv(
-    "data/worldfish-filtered.csv",
-    dtype={
-        "cg.identifier.status": "category",
-        "dc.rights": "category",
-        "dc.date.issued": "string[pyarrow]",
-    },
-    usecols=[
-        "dc.title",
-        "dc.creator",
-        "cg.contributor.affiliation",
-        "dc.description.abstract",
-        "cg.contributor.funder",
-        "dc.date.issued",
-        "dc.subject",
-        "cg.subject.agrovoc",
-        "dc.identifier.uri",
-        "dc.identifier.doi",
-        "cg.identifier.status",
-        "dc.rights",
-        "dc.source",
-        "dc.identifier.issn",
-        "dc.publisher",
-        "cg.coverage.country",
-    ],
-    dtype_backend="pyarrow",
-)
-df_cifor = pd.read_csv(
-    "data/cifor-filtered.csv",
-    dtype={"cifor.type.oa": "category", "dc.rights": "category"},
-    usecols=[
-        "dc.title",
-        "dc.contributor.author",
-        "dc.date.issued",
-        "dc.identifier.uri",
-        "dc.identifier.doi",
-        "dc.subject",
-        "cg.subject.cifor",
-        "cg.contributor.affiliation",
-        "cg.contributor.center",
-        "dc.description.abstract",
-        "cg.contributor.donor",
-        "cifor.source.title",
-        "dc.identifier.issn",
-        "cifor.source.volume",
-        "cifor.source.numbers",
-        "dc.publisher",
-        "cifor.type.oa",
-        "dc.rights",
-        "cifor.source.page",
-        "cg.coverage.country",
-    ],
-    dtype_backend="pyarrow",
-)
-df_ifpri = pd.read_csv(
-    "data/ifpri-filtered.csv",
-    dtype={
-        "Access rights": "category",
-        "Usage rights": "category",
-        "Publication date": "string[pyarrow]",
-    },
-    usecols=[
-        "Title",
-        "Authors",
-        "Publication date",
-        "Journal",
-        "Pages",
-        "Publisher",
-        "Abstract",
-        "Funders",
-        "ISSN",
-        "DOI",
-        "Subjects",
-        "Access rights",
-        "Usage rights",
-        "Repository link",
-    ],
-    dtype_backend="pyarrow",
-)
-df_irri = pd.read_csv(
-    "data/2023-10-16-IRRI-Climate-Change-fixed-filtered.csv",
-    dtype={"date issued": "string[pyarrow]"},
-    usecols=[
-        "title",
-        "issn",
-        "first author",
-        "other authors",
-        "publisher",
-        "journal",
-        "issn",
-        "date issued",
-        "extent",
-        "abstract",
-        "subjects",
-        "doi",
-    ],
-    dtype_backend="pyarrow",
-)
-df_icrisat = pd.read_csv(
-    "data/icrisat-filtered.csv",
-    dtype_backend="pyarrow",
-)
-df_cimmyt = pd.read_csv(
-    "data/cimmyt-filtered.csv",
-    dtype={"Publication date": "string[pyarrow]"},
-    dtype_backend="pyarrow",
-)
+# pyarrow dtypes use significantly less memory than pandas default dtypes. Read
+# the files concurrently since the CSV parser releases the GIL while tokenizing.
+with ThreadPoolExecutor(max_workers=8) as executor:
+    future_cgspace = executor.submit(
+        pd.read_csv,
+        "data/cgspace-filtered.csv",
+        dtype={"Access rights": "category", "Usage rights": "category"},
+        dtype_backend="pyarrow",
+    )
+    future_melspace = executor.submit(
+        pd.read_csv,
+        "data/melspace-filtered.csv",
+        dtype={"Access rights": "category", "Usage rights": "category"},
+        dtype_backend="pyarrow",
+    )
+    future_worldfish = executor.submit(
+        pd.read_csv,
+        "data/worldfish-filtered.csv",
+        dtype={
+            "cg.identifier.status": "category",
+            "dc.rights": "category",
+            "dc.date.issued": "string[pyarrow]",
+        },
+        usecols=[
+            "dc.title",
+            "dc.creator",
+            "cg.contributor.affiliation",
+            "dc.description.abstract",
+            "cg.contributor.funder",
+            "dc.date.issued",
+            "dc.subject",
+            "cg.subject.agrovoc",
+            "dc.identifier.uri",
+            "dc.identifier.doi",
+            "cg.identifier.status",
+            "dc.rights",
+            "dc.source",
+            "dc.identifier.issn",
+            "dc.publisher",
+            "cg.coverage.country",
+        ],
+        dtype_backend="pyarrow",
+    )
+    future_cifor = executor.submit(
+        pd.read_csv,
+        "data/cifor-filtered.csv",
+        dtype={"cifor.type.oa": "category", "dc.rights": "category"},
+        usecols=[
+            "dc.title",
+            "dc.contributor.author",
+            "dc.date.issued",
+            "dc.identifier.uri",
+            "dc.identifier.doi",
+            "dc.subject",
+            "cg.subject.cifor",
+            "cg.contributor.affiliation",
+            "cg.contributor.center",
+            "dc.description.abstract",
+            "cg.contributor.donor",
+            "cifor.source.title",
+            "dc.identifier.issn",
+            "cifor.source.volume",
+            "cifor.source.numbers",
+            "dc.publisher",
+            "cifor.type.oa",
+            "dc.rights",
+            "cifor.source.page",
+            "cg.coverage.country",
+        ],
+        dtype_backend="pyarrow",
+    )
+    future_ifpri = executor.submit(
+        pd.read_csv,
+        "data/ifpri-filtered.csv",
+        dtype={
+            "Access rights": "category",
+            "Usage rights": "category",
+            "Publication date": "string[pyarrow]",
+        },
+        usecols=[
+            "Title",
+            "Authors",
+            "Publication date",
+            "Journal",
+            "Pages",
+            "Publisher",
+            "Abstract",
+            "Funders",
+            "ISSN",
+            "DOI",
+            "Subjects",
+            "Access rights",
+            "Usage rights",
+            "Repository link",
+        ],
+        dtype_backend="pyarrow",
+    )
+    future_irri = executor.submit(
+        pd.read_csv,
+        "data/2023-10-16-IRRI-Climate-Change-fixed-filtered.csv",
+        dtype={"date issued": "string[pyarrow]"},
+        usecols=[
+            "title",
+            "issn",
+            "first author",
+            "other authors",
+            "publisher",
+            "journal",
+            "issn",
+            "date issued",
+            "extent",
+            "abstract",
+            "subjects",
+            "doi",
+        ],
+        dtype_backend="pyarrow",
+    )
+    future_icrisat = executor.submit(
+        pd.read_csv,
+        "data/icrisat-filtered.csv",
+        dtype_backend="pyarrow",
+    )
+    future_cimmyt = executor.submit(
+        pd.read_csv,
+        "data/cimmyt-filtered.csv",
+        dtype={"Publication date": "string[pyarrow]"},
+        dtype_backend="pyarrow",
+    )
+
+df_cgspace = future_cgspace.result()
+df_melspace = future_melspace.result()
+df_worldfish = future_worldfish.result()
+df_cifor = future_cifor.result()
+df_ifpri = future_ifpri.result()
+df_irri = future_irri.result()
+df_icrisat = future_icrisat.result()
+df_cimmyt = future_cimmyt.result()
 
 # Add source column
 df_cgspace["Source"] = "CGSpace DSpace"
@@ -150,21 +169,13 @@ df_irri["Source"] = "IRRI Library"
 df_icrisat["Source"] = "ICRISAT OAR"
 df_cimmyt["Source"] = "CIMMYT DSpace"
 
-# Concatenate subjects
-df_worldfish["Subjects"] = (
-    df_worldfish["dc.subject"]
-    .fillna("MISSING DATA")
-    .astype(str)
-    .str.cat(
-        df_worldfish["cg.subject.agrovoc"].fillna("MISSING DATA").astype(str), sep="; "
+# Concatenate subjects and rename columns in one chain. With copy-on-write the
+# intermediate data frames share their columns instead of copying them.
+df_worldfish = df_worldfish.assign(
+    Subjects=util.join_values(
+        df_worldfish["dc.subject"], df_worldfish["cg.subject.agrovoc"]
     )
-)
-
-df_worldfish["Subjects"] = df_worldfish["Subjects"].str.replace(
-    r"((;\s)?MISSING DATA(;\s)?)", "", regex=True
-)
-
-df_worldfish = df_worldfish.rename(
+).rename(
     columns={
         "dc.title": "Title",
         "dc.creator": "Authors",
@@ -183,41 +194,17 @@ df_worldfish = df_worldfish.rename(
     }
 )
 
-# Concatenate subjects. This is not very clever, but I can't figure out how to
-# deal with missing data, so I fill it with a placeholder text I can replace.
-df_cifor["dc.subject"] = (
-    df_cifor["dc.subject"]
-    .fillna("MISSING DATA")
-    .astype(str)
-    .str.cat(df_cifor["cg.subject.cifor"].fillna("MISSING DATA").astype(str), sep="; ")
-)
-
-# Ignore pandas warning about regex capture groups
-warnings.simplefilter(action="ignore", category=UserWarning)
-
-# Replace MISSING DATA
-# See: https://regex101.com/r/JeGDid/1
-df_cifor["dc.subject"] = df_cifor["dc.subject"].str.replace(
-    r"((;\s)?MISSING DATA(;\s)?)", "", regex=True
-)
-
-# Concatenate affiliations
-df_cifor["Author affiliations"] = (
-    df_cifor["cg.contributor.affiliation"]
-    .fillna("MISSING DATA")
-    .astype(str)
-    .str.cat(
-        df_cifor["cg.contributor.center"].fillna("MISSING DATA").astype(str), sep="; "
-    )
-)
-
-# Replace MISSING DATA
-df_cifor["Author affiliations"] = df_cifor["Author affiliations"].str.replace(
-    r"((;\s)?MISSING DATA(;\s)?)", "", regex=True
-)
-
-# Rename columns to match our biggest source CSV (CGSpace)
-df_cifor = df_cifor.rename(
+# Concatenate subjects and affiliations, skipping missing values, then rename
+# columns to match our biggest source CSV (CGSpace). Affiliations stay an empty
+# string when both are missing, so they aren't treated as missing later on.
+df_cifor = df_cifor.assign(
+    Subjects=util.join_values(df_cifor["dc.subject"], df_cifor["cg.subject.cifor"]),
+    **{
+        "Author affiliations": util.join_values(
+            df_cifor["cg.contributor.affiliation"], df_cifor["cg.contributor.center"]
+        ).fillna("")
+    },
+).rename(
     columns={
         "dc.title": "Title",
         "dc.contributor.author": "Authors",
@@ -228,7 +215,6 @@ df_cifor = df_cifor.rename(
         "dc.rights": "Usage rights",
         "dc.identifier.uri": "Repository link",
         "dc.date.issued": "Publication date",
-        "dc.subject": "Subjects",
         "cifor.source.title": "Journal",
         "dc.identifier.issn": "ISSN",
         "cifor.source.volume": "Volume",
@@ -245,17 +231,7 @@ df_cifor["Repository link"] = df_cifor["Repository link"].str.replace(
 )
 
 # Concatenate authors since IRRI separates the first author and other authors
-df_irri["Authors"] = (
-    df_irri["first author"]
-    .fillna("MISSING DATA")
-    .astype(str)
-    .str.cat(df_irri["other authors"].fillna("MISSING DATA").astype(str), sep="; ")
-)
-
-# Replace MISSING DATA
-df_irri["Authors"] = df_irri["Authors"].str.replace(
-    r"((;\s)?MISSING DATA(;\s)?)", "", regex=True
-)
+df_irri["Authors"] = util.join_values(df_irri["first author"], df_irri["other authors"])
 
 # Add spaces after semicolons where they are missing
 df_irri["Authors"] = df_irri["Authors"].str.replace(r";[^ ]", "; ", regex=True)
@@ -283,29 +259,64 @@ df_irri = df_irri.rename(
 
 logger.info("Merging sources...")
 
+# Columns we use from the sources. Anything else (like the IRRI first and other
+# author columns) is dropped before we concatenate so we don't have to carry it
+# along until the final filter.
+source_columns = [
+    "Title",
+    "Authors",
+    "Author affiliations",
+    "Abstract",
+    "Funders",
+    "DOI",
+    "Publication date",
+    "Publication date (Online)",
+    "Journal",
+    "ISSN",
+    "Volume",
+    "Issue",
+    "Pages",
+    "Publisher",
+    "Subjects",
+    "Countries",
+    "Access rights",
+    "Usage rights",
+    "Repository link",
+    "Source",
+]
+
 # Concatenate the data frames
 # See: https://stackoverflow.com/a/48052579
 df_final = pd.concat(
     [
-        df_cgspace,
-        df_melspace,
-        df_worldfish,
-        df_cifor,
-        df_ifpri,
-        df_irri,
-        df_icrisat,
-        df_cimmyt,
+        df.filter(items=source_columns)
+        for df in [
+            df_cgspace,
+            df_melspace,
+            df_worldfish,
+            df_cifor,
+            df_ifpri,
+            df_irri,
+            df_icrisat,
+            df_cimmyt,
+        ]
     ],
     join="outer",
+    ignore_index=True,
 )
 
+# Source only has a handful of values, and many articles share a journal, so
+# store them as categoricals rather than repeating the same strings for every
+# row. Neither column is modified after this.
+df_final = df_final.astype({"Source": "category", "Journal": "category"})
+
 # Check how many rows we have total before removing any records
 total_number_records = df_final.shape[0]
 
 logger.info(f"Starting with {total_number_records} records...\n")
 
 # Normalize DOIs so we can deduplicate them
-df_final["DOI"] = df_final["DOI"].apply(util.normalize_doi)
+df_final["DOI"] = util.normalize_dois(df_final["DOI"])
 
 logger.info("Removing duplicates...")
 
@@ -313,22 +324,22 @@ logger.info("Removing duplicates...")
 # instead of the much simpler drop_duplicates() because blanks are considered
 # duplicates, which means we drop records that don't have DOIs!
 # See: https://stackoverflow.com/questions/50154835/drop-duplicates-but-ignore-nulls
-df_final = df_final[(~df_final["DOI"].duplicated()) | df_final["DOI"].isna()]
+keep = ~df_final["DOI"].duplicated() | df_final["DOI"].isna()
 
 # Update count of removed records
-removed = total_number_records - df_final.shape[0]
+removed = total_number_records - keep.sum()
 logger.info(f"> Removed {removed} duplicate DOIs")
 
-# Check how many rows we have total before deduplicating titles
-total_number_records = df_final.shape[0]
-
 # Remove duplicates using the title as the unique identifier. This is just in
 # case there are duplicate titles, as sometimes the same DOI can have a typo
-# or differ in case, etc.
-df_final = df_final.drop_duplicates(subset=["Title"], keep="first")
+# or differ in case, etc. Only the records left after removing duplicate DOIs
+# are considered, and we filter the data frame once for both.
+duplicate_titles = df_final.loc[keep, "Title"].duplicated()
+keep[duplicate_titles.index] = ~duplicate_titles
+
+logger.info(f"> Removed {duplicate_titles.sum()} duplicate titles\n")
 
-removed = total_number_records - df_final.shape[0]
-logger.info(f"> Removed {removed} duplicate titles\n")
+df_final = df_final[keep]
 
 ###
 # Normalize subjects
@@ -344,15 +355,15 @@ df_final["Subjects"] = df_final["Subjects"].str.lower()
 # See: https://regex101.com/r/PEMT8t/1
 # At the beginning
 df_final["Subjects"] = df_final["Subjects"].str.replace(
-    r"^(cambio climatico|cambio climático|climate change);?\s?", "", regex=True
+    r"^(?:cambio climatico|cambio climático|climate change);?\s?", "", regex=True
 )
 # In the middle
 df_final["Subjects"] = df_final["Subjects"].str.replace(
-    r";\s?(cambio climatico|cambio climático|climate change);\s?", "; ", regex=True
+    r";\s?(?:cambio climatico|cambio climático|climate change);\s?", "; ", regex=True
 )
 # At the end
 df_final["Subjects"] = df_final["Subjects"].str.replace(
-    r"(cambio climatico|cambio climático|climate change)$", "", regex=True
+    r"(?:cambio climatico|cambio climático|climate change)$", "", regex=True
 )
 
 # Deduplicate subjects since we've merged various keyword and subject fields
@@ -361,70 +372,81 @@ df_final["Subjects"] = df_final["Subjects"].apply(util.deduplicate_subjects)
 logger.info(f"Removing preprints, books, drafts, etc...")
 
 # Filter out some DOIs that we exclude from the set. For example preprints,
-# book chapters, etc that have been miscataloged in a CGIAR repository).
-total_number_records = df_final.shape[0]
+# book chapters, etc that have been miscataloged in a CGIAR repository). We
+# build one mask for both lists so we only filter the data frame once.
 
 # Filter DOIs by our `data/dois-to-remove.csv` list
-df_dois_to_remove = pd.read_csv("data/dois-to-remove.csv")
-df_final = df_final[~df_final["DOI"].isin(df_dois_to_remove["doi"])]
-removed = total_number_records - df_final.shape[0]
-logger.info(
-    f"> Removed {removed} DOIs (out of {df_dois_to_remove.shape[0]} considered)"
-)
+dois_to_remove = util.read_values("data/dois-to-remove.csv", "doi")
+remove = df_final["DOI"].isin(dois_to_remove)
+removed = remove.sum()
+logger.info(f"> Removed {removed} DOIs (out of {len(dois_to_remove)} considered)")
 
-total_number_records = df_final.shape[0]
+# Other URLs to remove, not counting records we already removed by DOI
+urls_to_remove = util.read_values("data/urls-to-remove.csv", "url")
+remove_urls = df_final["Repository link"].isin(urls_to_remove) & ~remove
+removed = remove_urls.sum()
+logger.info(f"> Removed {removed} URLs (out of {len(urls_to_remove)} considered)\n")
 
-# Other URLs to remove
-df_urls_to_remove = pd.read_csv("data/urls-to-remove.csv")
-df_final = df_final[~df_final["Repository link"].isin(df_urls_to_remove["url"])]
-removed = total_number_records - df_final.shape[0]
-logger.info(
-    f"> Removed {removed} URLs (out of {df_urls_to_remove.shape[0]} considered)\n"
-)
+df_final = df_final[~(remove | remove_urls)]
+
+# Check which items have DOIs once, since we use it twice below
+has_doi = df_final["DOI"].str.startswith("https://doi.org/10.", na=False)
 
 # Write a record of items missing DOIs
-df_final_missing_dois = df_final[
-    ~df_final["DOI"].str.startswith("https://doi.org/10.", na=False)
-]
+df_final_missing_dois = df_final[~has_doi]
 logger.info(
     f"Writing {df_final_missing_dois.shape[0]} records to /tmp/output-missing-dois.csv\n"
 )
 df_final_missing_dois.to_csv("/tmp/output-missing-dois.csv", index=False)
 
 # Extract only items with DOIs, as per the inclusion criteria of the review
-df_final = df_final[df_final["DOI"].str.startswith("https://doi.org/10.", na=False)]
+df_final = df_final[has_doi]
 
 total_number_records = df_final.shape[0]
 logger.info(f"Processing remaining {total_number_records} records...")
 
 logger.info(f"> Looking up licenses on Crossref...")
-# Get licenses from Crossref because it's more reliable and standardized
-df_final["Crossref"] = df_final["DOI"].apply(util.get_license)
+# Get licenses from Crossref because it's more reliable and standardized. We
+# look up the unique DOIs in batches rather than making a request for each.
+licenses = util.get_licenses(df_final["DOI"].unique().tolist())
+df_final["Crossref"] = df_final["DOI"].map(licenses)
 # Fill in missing licenses from repository metadata
 df_final["Usage rights"] = df_final["Crossref"].combine_first(df_final["Usage rights"])
 df_final = df_final.drop("Crossref", axis="columns")
-# Minor alignment for CIFOR licenses
-df_final["Usage rights"] = df_final["Usage rights"].str.replace(
-    "Attribution 4.0", "CC-BY-4.0"
+# Usage rights only have a few distinct values, so store them as a categorical
+# and do the minor alignment for CIFOR licenses on the categories only. We map
+# the old categories to the new ones rather than renaming them because the new
+# value is usually a category already.
+df_final["Usage rights"] = df_final["Usage rights"].astype("category")
+usage_rights = df_final["Usage rights"].cat.categories
+usage_rights_aligned = usage_rights.str.replace("Attribution 4.0", "CC-BY-4.0")
+df_final["Usage rights"] = (
+    df_final["Usage rights"]
+    .map(dict(zip(usage_rights, usage_rights_aligned)))
+    .astype("category")
 )
 
 logger.info("> Looking up access rights on Unpaywall...")
 # Get access rights from Unpaywall because it's more reliable and standardized
-df_final["Unpaywall"] = df_final["DOI"].apply(util.get_access_rights)
+df_final["Unpaywall"] = util.map_concurrently(util.get_access_rights, df_final["DOI"])
 # Fill in missing access rights from repository metadata
 df_final["Access rights"] = df_final["Unpaywall"].combine_first(
     df_final["Access rights"]
 )
 df_final = df_final.drop("Unpaywall", axis="columns")
-# Minor alignment for CIFOR and MELSpace access rights
-df_final["Access rights"] = df_final["Access rights"].str.replace(
-    "Closed access", "Limited Access"
-)
-df_final["Access rights"] = df_final["Access rights"].str.replace(
-    "Gold open access", "Gold Open Access"
-)
-df_final["Access rights"] = df_final["Access rights"].str.replace(
-    "Open access", "Open Access"
+# Minor alignment for CIFOR and MELSpace access rights. These are whole values
+# so we can replace them all in one pass, then store them as a categorical since
+# there are only a few distinct values.
+df_final["Access rights"] = (
+    df_final["Access rights"]
+    .replace(
+        {
+            "Closed access": "Limited Access",
+            "Gold open access": "Gold Open Access",
+            "Open access": "Open Access",
+        }
+    )
+    .astype("category")
 )
 
 # Write all DOIs to text for debugging
@@ -432,77 +454,70 @@ df_final["DOI"].to_csv("/tmp/dois.txt", header=False, index=False)
 
 logger.info("> Checking for PDFs...")
 # After dropping items without DOIs, check if we have the PDF
-df_final["PDF"] = df_final["DOI"].apply(util.pdf_exists)
+df_final["PDF"] = util.get_pdf_files(df_final["DOI"])
 
 # Determine the publication date by getting the earlier of the issue date and
-# the online date. The `axis=1` means we want to apply this function on each
-# row instead of each column, so we can compare the item's dates.
-df_final["Publication date"] = df_final.apply(util.get_publication_date, axis=1)
+# the online date
+df_final["Publication date"] = util.get_publication_date(df_final)
 
-# Retrieve missing abstracts from OpenAlex
+# Retrieve missing abstracts from OpenAlex. We only look up the records that are
+# missing them, several at a time.
 logger.info("> Retrieving missing abstracts from OpenAlex...")
-df_final["Abstract"] = df_final.apply(util.retrieve_abstract_openalex, axis=1)
+abstracts = util.map_concurrently(
+    util.retrieve_abstract_openalex, df_final.loc[df_final["Abstract"].isna(), "DOI"]
+)
+df_final["Abstract"] = df_final["Abstract"].combine_first(abstracts)
 
 # Retrieve missing publishers from Crossref
 logger.info(f"> Retrieving missing publishers from Crossref...")
-df_final["Publisher"] = df_final.apply(util.retrieve_publisher_crossref, axis=1)
+publishers = util.map_concurrently(
+    util.retrieve_publisher_crossref, df_final.loc[df_final["Publisher"].isna(), "DOI"]
+)
+df_final["Publisher"] = df_final["Publisher"].combine_first(publishers)
 
 # Normalize some variants of big publishers, by count in our dataset, based on
-# some of the cases I noticed.
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Elsevier.+", "Elsevier", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Springer.+", "Springer", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^.*Wiley.+", "Wiley", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^MDPI.+", "MDPI", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Frontiers.+", "Frontiers", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Public Library of Science.+", "Public Library of Science", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^PLOS.*", "Public Library of Science", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Cambridge University Press.+", "Cambridge University Press", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Taylor (and|&) Francis.*", "Taylor & Francis", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Oxford University Press.+", "Oxford University Press", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Emerald.+", "Emerald", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^The Royal Society", "Royal Society", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^CABI.*", "CAB International", regex=True
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^Crop Science Society of America (CSSA)",
-    "Crop Science Society of America",
-    regex=True,
-)
-df_final["Publisher"] = df_final["Publisher"].str.replace(
-    r"^CSIRO.*",
-    "Commonwealth Scientific and Industrial Research Organisation",
-    regex=True,
+# some of the cases I noticed. The rules are applied in order.
+publisher_rules = [
+    (r"^Elsevier.+", "Elsevier"),
+    (r"^Springer.+", "Springer"),
+    (r"^.*Wiley.+", "Wiley"),
+    (r"^MDPI.+", "MDPI"),
+    (r"^Frontiers.+", "Frontiers"),
+    (r"^Public Library of Science.+", "Public Library of Science"),
+    (r"^PLOS.*", "Public Library of Science"),
+    (r"^Cambridge University Press.+", "Cambridge University Press"),
+    (r"^Taylor (?:and|&) Francis.*", "Taylor & Francis"),
+    (r"^Oxford University Press.+", "Oxford University Press"),
+    (r"^Emerald.+", "Emerald"),
+    (r"^The Royal Society", "Royal Society"),
+    (r"^CABI.*", "CAB International"),
+    (r"^Crop Science Society of America (CSSA)", "Crop Science Society of America"),
+    (r"^CSIRO.*", "Commonwealth Scientific and Industrial Research Organisation"),
+]
+
+# Publishers repeat a lot, so store them as a categorical and apply the rules to
+# the unique publishers only, then map each one to its normalized name.
+df_final["Publisher"] = df_final["Publisher"].astype("category")
+publishers = df_final["Publisher"].cat.categories
+publishers_normalized = publishers
+for pattern, replacement in publisher_rules:
+    publishers_normalized = publishers_normalized.str.replace(
+        pattern, replacement, regex=True
+    )
+df_final["Publisher"] = (
+    df_final["Publisher"]
+    .map(dict(zip(publishers, publishers_normalized)))
+    .astype("category")
 )
 
 # Retrieve missing affiliations from OpenAlex
 logger.info("> Retrieving missing affiliations from OpenAlex...")
-df_final["Author affiliations"] = df_final.apply(
-    util.retrieve_affiliations_openalex, axis=1
+missing_affiliations = df_final["Author affiliations"].isna()
+affiliations = util.map_concurrently(
+    util.retrieve_affiliations_openalex, df_final.loc[missing_affiliations, "DOI"]
+)
+df_final["Author affiliations"] = df_final["Author affiliations"].combine_first(
+    affiliations
 )
 
 # Normalize CGIAR centers from the mess of affiliations
@@ -517,24 +532,21 @@ df_final["Author affiliations"] = df_final["Author affiliations"].apply(
 # Filter abstracts to err on the side of caution regarding distribution of copy-
 # righted material.
 logger.info("> Filtering copyrighted abstracts...")
-df_final["Abstract"] = df_final.apply(util.filter_abstracts, axis=1)
+df_final["Abstract"] = util.filter_abstracts(df_final)
 
 # Attempt to extract missing countries from titles and abstracts
 logger.info("> Extracting missing countries...")
-df_final["Countries"] = df_final.apply(util.extract_missing_countries, axis=1)
+df_final["Countries"] = util.extract_missing_countries(df_final)
 
 # Normalize and de-duplicate countries
 logger.info("> Normalizing countries...")
-df_final["Countries"] = df_final["Countries"].apply(util.normalize_countries)
-df_final["Countries"] = df_final["Countries"].apply(util.deduplicate_subjects)
+df_final["Countries"] = util.normalize_countries(df_final["Countries"])
 
 logger.info("> Adding regions...")
-df_final["Regions"] = df_final["Countries"].apply(util.add_regions)
-df_final["Regions"] = df_final["Regions"].apply(util.deduplicate_subjects)
+df_final["Regions"] = util.add_regions(df_final["Countries"])
 
 logger.info("> Adding continents...\n")
-df_final["Continents"] = df_final["Countries"].apply(util.add_continents)
-df_final["Continents"] = df_final["Continents"].apply(util.deduplicate_subjects)
+df_final["Continents"] = util.add_continents(df_final["Countries"])
 
 # Use YYYY dates for Rayyan
 df_final["Publication date"] = df_final["Publication date"].str.slice(start=0, stop=4)
@@ -579,16 +591,14 @@ logger.info("Preparing primary dataset...")
 
 # Import list of DOIs that were included in the review on Rayyan. This is the
 # primary dataset matching original CGIAR research on climate change.
-df_dois_in_review = pd.read_csv("data/included-in-review.csv")
-logger.info(
-    f"> Considering {df_dois_in_review.shape[0]} records included in Rayyan screening"
-)
+dois_in_review = util.read_values("data/included-in-review.csv", "doi")
+logger.info(f"> Considering {len(dois_in_review)} records included in Rayyan screening")
 
 # Add a column for original research. These are DOIs that were included in the
 # review.
-df_final["Original research"] = df_final["DOI"].isin(df_dois_in_review["doi"])
+df_final["Original research"] = df_final["DOI"].isin(dois_in_review)
 
-df_final_in_review = df_final[df_final["DOI"].isin(df_dois_in_review["doi"])]
+df_final_in_review = df_final[df_final["Original research"]]
 logger.info(f"> Found {df_final_in_review.shape[0]} records in dataset")
 logger.info(
     f"> Writing {df_final_in_review.shape[0]} records to /tmp/output-used-in-review.csv\n"
@@ -599,14 +609,10 @@ df_final_in_review.to_csv("/tmp/output-used-in-review.csv", index=False)
 # that were climate change related, but not original research (like reviews,
 # syntheses, opinion, etc).
 logger.info("Preparing 'combined' dataset...")
-df_dois_combined_dataset = pd.read_csv("data/dois-for-combined-dataset.csv")
-logger.info(
-    f"> Considering {df_dois_combined_dataset.shape[0]} records for combined dataset"
-)
+dois_combined_dataset = util.read_values("data/dois-for-combined-dataset.csv", "doi")
+logger.info(f"> Considering {len(dois_combined_dataset)} records for combined dataset")
 
-df_final_combined_dataset = df_final[
-    df_final["DOI"].isin(df_dois_combined_dataset["doi"])
-]
+df_final_combined_dataset = df_final[df_final["DOI"].isin(dois_combined_dataset)]
 logger.info(f"> Found {df_final_combined_dataset.shape[0]} records in dataset")
 # Write to a CSV without an index column
 logger.info(
@@ -616,37 +622,25 @@ df_final_combined_dataset.to_csv("/tmp/output-combined.csv", index=False)
 
 logger.info("Preparing datasets for thematic areas...")
 
-df_dois_drought_dataset = pd.read_csv("data/dois-thematic-analysis-drought.csv")
-df_final_drought_dataset = df_final[
-    df_final["DOI"].isin(df_dois_drought_dataset["doi"])
-]
-logger.info(
-    f"> Writing {df_final_drought_dataset.shape[0]} records to /tmp/output-drought.csv"
-)
-df_final_drought_dataset.to_csv("/tmp/output-drought.csv", index=False)
-
-df_dois_rainfall_dataset = pd.read_csv("data/dois-thematic-analysis-rainfall.csv")
-df_final_rainfall_dataset = df_final[
-    df_final["DOI"].isin(df_dois_rainfall_dataset["doi"])
-]
-logger.info(
-    f"> Writing {df_final_rainfall_dataset.shape[0]} records to /tmp/output-rainfall.csv"
-)
-df_final_rainfall_dataset.to_csv("/tmp/output-rainfall.csv", index=False)
-
-df_dois_adaptation_dataset = pd.read_csv("data/dois-thematic-analysis-adaptation.csv")
-df_final_adaptation_dataset = df_final[
-    df_final["DOI"].isin(df_dois_adaptation_dataset["doi"])
-]
-logger.info(
-    f"> Writing {df_final_adaptation_dataset.shape[0]} records to /tmp/output-adaptation.csv\n"
-)
-df_final_adaptation_dataset.to_csv("/tmp/output-adaptation.csv", index=False)
+for theme in ["drought", "rainfall", "adaptation"]:
+    dois_theme_dataset = util.read_values(
+        f"data/dois-thematic-analysis-{theme}.csv", "doi"
+    )
+    df_final_theme_dataset = df_final[df_final["DOI"].isin(dois_theme_dataset)]
+    logger.info(
+        f"> Writing {df_final_theme_dataset.shape[0]} records to /tmp/output-{theme}.csv"
+    )
+    df_final_theme_dataset.to_csv(f"/tmp/output-{theme}.csv", index=False)
 
 # Write to a CSV without an index column
 logger.info(f"Writing {df_final.shape[0]} records to /tmp/output.csv")
 df_final.to_csv("/tmp/output.csv", index=False)
 
+# Also write a compressed Feather file, which keeps the column types and is much
+# faster to load again than the CSV if we need to do more analysis later
+logger.info(f"Writing {df_final.shape[0]} records to /tmp/output.feather")
+df_final.reset_index(drop=True).to_feather("/tmp/output.feather", compression="zstd")
+
 df_final_missing_pdfs = df_final[df_final["PDF"].isna()]
 logger.info(
     f"Writing {df_final_missing_pdfs.shape[0]} records to /tmp/output-missing-pdfs.csv"
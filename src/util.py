@@ -8,13 +8,18 @@
 # Various helper functions for Python scripts.
 #
 
+import csv
 import gzip
 import logging
 import os
 import re
 import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
 
 import country_converter as coco
 import pandas as pd
@@ -28,16 +33,61 @@ import requests_cache
 logger = logging.getLogger(__name__)
 
 # We must use the monkey-patching method of requests_cache instead of the more
-# clean CachedSession because pyalex can't use the session manager.
+# clean CachedSession because pyalex can't use the session manager. Use
+# write-ahead logging so concurrent lookups don't block on cache writes.
 requests_cache.install_cache(
-    "util-cache", expire_after=timedelta(days=30), allowable_codes=(200, 404)
+    "util-cache",
+    backend="sqlite",
+    wal=True,
+    expire_after=timedelta(days=30),
+    allowable_codes=(200, 404),
 )
 
-requests_cache.delete(expired=True)
-
 cc = coco.CountryConverter()
 
 
+def prune_cache(cache, interval: timedelta = timedelta(days=1)):
+    """
+    Delete expired responses from a requests-cache SQLite backend unless we
+    already did so within the interval. Pruning scans the entire database so
+    it is slow on big caches, and we don't need to do it on every run. We keep
+    track of the last time we pruned with a stamp file next to the cache.
+    """
+    stamp = f"{cache.db_path}.pruned"
+
+    try:
+        last_pruned = datetime.fromtimestamp(os.path.getmtime(stamp))
+    except FileNotFoundError:
+        last_pruned = datetime.min
+
+    if datetime.now() - last_pruned < interval:
+        return
+
+    cache.delete(expired=True)
+
+    # Touch the stamp file to record when we pruned
+    with open(stamp, "w"):
+        pass
+
+
+prune_cache(requests_cache.get_cache())
+
+
+def map_concurrently(func, series: pd.Series, max_workers: int = 16) -> pd.Series:
+    """
+    Apply a function to each value of a Series using a pool of threads. This is
+    much faster than Series.apply() for functions that spend most of their time
+    waiting on network requests. Results are in the same order as the values.
+    The function is only called once for each unique value (including missing).
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = pd.Series(list(executor.map(func, uniques)), dtype=object)
+
+    return results.take(codes).set_axis(series.index)
+
+
 def get_access_rights(doi: str):
     access_rights = pd.NA
 
@@ -105,12 +155,73 @@ def get_license(doi: str):
     if not r.ok:
         return license
 
-    data = r.json()
+    return parse_crossref_license(r.json()["message"])
+
+
+def get_licenses(dois: list) -> dict:
+    """
+    Look up the licenses of many DOIs on Crossref, filtering the works endpoint
+    by up to 100 DOIs at a time instead of making one request per DOI. DOIs we
+    can't get this way are looked up one by one. Returns a dict mapping each
+    DOI to its license.
+    """
+    # Opportunistically use an email address from the environment to make
+    # sure we get better access to the API.
+    try:
+        request_params = {"mailto": os.environ["EMAIL"]}
+    except KeyError:
+        request_params = {}
+
+    dois = [doi for doi in dois if doi.startswith("https://doi.org/10.")]
+    licenses = {}
+
+    # Commas separate the filters, so DOIs containing them need to be looked up
+    # one by one, along with DOIs from failed batches or missing in the results
+    remaining = [doi for doi in dois if "," in doi]
+    dois = [doi for doi in dois if "," not in doi]
+
+    for i in range(0, len(dois), 100):
+        batch = dois[i : i + 100]
+        doi_filter = ",".join(
+            f"doi:{doi.removeprefix('https://doi.org/')}" for doi in batch
+        )
+
+        r = requests.get(
+            "https://api.crossref.org/works",
+            params={**request_params, "filter": doi_filter, "rows": len(batch)},
+        )
+
+        if not r.ok:
+            logger.error(
+                f"Cannot look up {len(batch)} licenses on Crossref ({r.status_code})"
+            )
+            remaining.extend(batch)
+
+            continue
+
+        for work in r.json()["message"]["items"]:
+            doi = f"https://doi.org/{work['DOI'].lower()}"
+            licenses[doi] = parse_crossref_license(work)
+
+        remaining.extend(doi for doi in batch if doi not in licenses)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        licenses.update(zip(remaining, executor.map(get_license, remaining)))
+
+    return licenses
+
+
+def parse_crossref_license(message: dict):
+    """
+    Get a normalized license from a Crossref work, or pd.NA if we can't
+    determine one.
+    """
+    license = pd.NA
 
     # Extract license strings from Crossref in the order we prefer them
     doi_licenses = {}
     try:
-        for doi_license in data["message"]["license"]:
+        for doi_license in message["license"]:
             content_version = doi_license["content-version"]
             doi_licenses[content_version] = doi_license["URL"]
 
@@ -197,21 +308,22 @@ def get_license(doi: str):
     return license
 
 
-def pdf_exists(doi: str):
-    if pd.isna(doi):
-        return pd.NA
-
-    # Strip URI prefix
-    doi = doi.replace("https://doi.org/", "")
+def get_pdf_files(dois: pd.Series, pdf_dir: str = "data/pdf") -> pd.Series:
+    """
+    Get the local PDF file name for each DOI, or NA if we don't have the PDF.
+    The PDF directory is listed once instead of checking each file separately.
+    """
+    try:
+        with os.scandir(pdf_dir) as entries:
+            pdf_files = {entry.name for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        pdf_files = set()
 
-    doi_pdf_file = f'{doi.replace("/", "-")}.pdf'
-    pdf_path = f"data/pdf/{doi_pdf_file}"
+    # Strip URI prefix and replace slashes to get the file names
+    doi_pdf_files = dois.str.replace("https://doi.org/", "", regex=False)
+    doi_pdf_files = doi_pdf_files.str.replace("/", "-", regex=False) + ".pdf"
 
-    # Check if we have the PDF for this DOI locally
-    if os.path.isfile(pdf_path):
-        return doi_pdf_file
-    else:
-        return pd.NA
+    return doi_pdf_files.where(doi_pdf_files.isin(pdf_files))
 
 
 # Try to see which DSpace version this is
@@ -263,75 +375,94 @@ def detect_dspace_version(dspace_root: str) -> str:
         sys.exit(1)
 
 
-# Deduplicate subject string by splitting on "; " and re-building in a set. This
-# is guaranteed to be unique in Python and should preserve the order as well.
+# Deduplicate subject string by splitting on "; " and re-building it from the
+# keys of a dict. Dict keys are unique and preserve the insertion order.
 def deduplicate_subjects(subjects: str) -> str:
     if pd.isna(subjects):
         return pd.NA
 
-    seen = set()
-    deduped_list = [
-        x for x in subjects.split("; ") if x not in seen and not seen.add(x)
-    ]
-
-    return "; ".join(deduped_list)
+    return "; ".join(dict.fromkeys(subjects.split("; ")))
 
 
 # Determine the publication date as the earlier of the issue date and the online
 # date. This is what Crossref does and allows us to have one "Publication date".
 # For this to work we need to assume every item has *at least* one of the issue
-# or online dates, and they are in YYYY, YYYY-MM, or YYYY-MM-DD format.
-def get_publication_date(row: pd.Series) -> str:
-    if pd.isna(row["Publication date"]):
-        issue_date_dt = False
-    else:
-        issue_date = row["Publication date"]
-        issue_date_dt = False
-
-        # Split the item date on "-" to see what format we need to
-        # use to create the datetime object.
-        if len(issue_date.split("-")) == 1:
-            issue_date_dt = datetime.strptime(issue_date, "%Y")
-        elif len(issue_date.split("-")) == 2:
-            issue_date_dt = datetime.strptime(issue_date, "%Y-%m")
-        elif len(issue_date.split("-")) == 3:
-            issue_date_dt = datetime.strptime(issue_date, "%Y-%m-%d")
-
-    if pd.isna(row["Publication date (Online)"]):
-        online_date_dt = False
-    else:
-        online_date = row["Publication date (Online)"]
-        online_date_dt = False
-
-        if len(online_date.split("-")) == 1:
-            online_date_dt = datetime.strptime(online_date, "%Y")
-        elif len(online_date.split("-")) == 2:
-            online_date_dt = datetime.strptime(online_date, "%Y-%m")
-        elif len(online_date.split("-")) == 3:
-            online_date_dt = datetime.strptime(online_date, "%Y-%m-%d")
-
-    if issue_date_dt and online_date_dt:
-        if issue_date_dt < online_date_dt:
-            publication_date = issue_date
-        # Always return the issue date if online date is in 2011 since our inc-
-        # lusion criteria is 2012–2023 and this could be misleading.
-        elif online_date.startswith("2011"):
-            publication_date = issue_date
-        else:
-            publication_date = online_date
-    elif issue_date_dt and not online_date_dt:
-        publication_date = issue_date
-    elif online_date_dt and not issue_date_dt:
-        publication_date = online_date
+# or online dates, and they are in YYYY, YYYY-MM, or YYYY-MM-DD format. We parse
+# both date columns at once and pick the dates with a mask, which is much faster
+# than comparing them row by row.
+def get_publication_date(df: pd.DataFrame) -> pd.Series:
+    issue_date = df["Publication date"]
+    online_date = df["Publication date (Online)"]
+
+    issue_date_dt = pd.to_datetime(issue_date, format="ISO8601", errors="coerce")
+    online_date_dt = pd.to_datetime(online_date, format="ISO8601", errors="coerce")
+
+    # Use the online date if there is no issue date, or if it is not later than
+    # the issue date. Always use the issue date if the online date is in 2011,
+    # since our inclusion criteria is 2012–2023 and this could be misleading.
+    use_online_date = online_date_dt.notna() & (
+        issue_date_dt.isna()
+        | (
+            (online_date_dt <= issue_date_dt)
+            & ~online_date.str.startswith("2011", na=False)
+        )
+    )
 
-    return publication_date
+    return issue_date.mask(use_online_date, online_date)
 
 
+def join_values(first: pd.Series, second: pd.Series, sep: str = "; ") -> pd.Series:
+    """
+    Join the values of two Series with a separator, skipping missing values.
+    The result is only missing where both values are missing.
+    """
+    joined = first.str.cat(second, sep=sep)
+
+    return joined.fillna(first).fillna(second)
+
+
+def read_values(path: str, column: str) -> frozenset:
+    """
+    Read the values of one column of a CSV file into a set. This is lighter
+    than a data frame for the small lists of DOIs and URLs we filter on.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        return frozenset(row[column] for row in csv.DictReader(f))
+
+
+def get_metadata_value(metadata: dict, *fields: str) -> str:
+    """
+    Return the first value of the first field that is present in a DSpace 7
+    item's metadata, or an empty string if none of the fields are present.
+    """
+    for field in fields:
+        values = metadata.get(field)
+
+        if values:
+            return values[0]["value"]
+
+    return ""
+
+
+def get_metadata_values(metadata: dict, *fields: str) -> list:
+    """
+    Return all values of the given fields in a DSpace 7 item's metadata, in
+    the order the fields are given.
+    """
+    metadata_values = chain.from_iterable(metadata.get(field, ()) for field in fields)
+
+    return list(map(itemgetter("value"), metadata_values))
+
+
+@lru_cache(maxsize=4096)
 def clean_string(string):
     """
     Clean a string, as I saw some titles and subjects with newlines in them.
     We can't be sure if it is a CR, LF, CRLF, etc, so let's replace both in
     separate passes and then trim the double space if need be.
+
+    Results are cached because the same keywords, journals, and publishers
+    repeat across many records.
     """
 
     string = string.replace("\n", " ")
@@ -380,30 +511,61 @@ def normalize_doi(doi):
     return f"https://doi.org/{doi.lower().strip()}"
 
 
-def normalize_countries(countries):
+def normalize_dois(dois: pd.Series) -> pd.Series:
     """
-    Try to normalize country names to common short names.
+    Normalize a Series of DOIs the same way as normalize_doi(), using string
+    operations on the whole column instead of calling it for each value.
     """
-    if pd.isna(countries):
-        return pd.NA
+    dois = dois.str.replace("doi:", "", regex=False)
+    dois = dois.str.replace(r"^0\.", "10.", regex=True)
+    dois = dois.str.replace("http://dx.doi.org/DOI:", "", regex=False)
+    dois = dois.str.replace(r"^https?://(dx\.)?doi\.org/", "", regex=True)
+    dois = dois.str.replace("https:// doi.org/", "", regex=False)
+    dois = dois.str.replace("https://www.tandfonline.com/doi/full/", "", regex=False)
+    dois = dois.str.replace("\u200b", "", regex=False)
+
+    return "https://doi.org/" + dois.str.lower().str.strip()
+
+
+def convert_countries(countries: pd.Series, to: str) -> pd.Series:
+    """
+    Convert a Series of "; "-separated country lists with country_converter.
+    Each unique country is converted only once, then the lists are rebuilt
+    without the countries that were not found or are duplicated.
+    """
+    countries_exploded = countries.str.split("; ").explode()
+    countries_unique = countries_exploded.dropna().unique()
 
     # Don't print "Tibet not found in regex" etc
     coco_logger = coco.logging.getLogger()
     coco_logger.setLevel(logging.CRITICAL)
 
-    # Convert to common short names (using a Pandas Series is 4000x faster)
-    countries_normalized = cc.pandas_convert(
-        series=pd.Series(countries.split("; ")), to="name_short"
-    )
+    # Convert all the countries at once (using a Pandas Series is 4000x faster)
+    countries_converted = cc.pandas_convert(series=pd.Series(countries_unique), to=to)
 
     # Reset log level
     coco_logger.setLevel(logger.level)
 
-    countries_normalized = [
-        country for country in countries_normalized if country != "not found"
+    countries_converted = countries_exploded.map(
+        dict(zip(countries_unique, countries_converted))
+    )
+    countries_converted = countries_converted[
+        countries_converted.notna() & (countries_converted != "not found")
+    ]
+    # Different spellings can convert to the same country, so drop duplicates
+    # within each list (by row and value) before joining them again
+    countries_converted = countries_converted[
+        ~countries_converted.reset_index().duplicated().to_numpy()
     ]
 
-    return "; ".join(countries_normalized)
+    return countries_converted.groupby(level=0).agg("; ".join).reindex(countries.index)
+
+
+def normalize_countries(countries: pd.Series) -> pd.Series:
+    """
+    Try to normalize country names to common short names.
+    """
+    return convert_countries(countries, to="name_short")
 
 
 # Filter our abstracts so we don't accidentally distribute copyrighted material.
@@ -412,101 +574,61 @@ def normalize_countries(countries):
 # agreement allowing you to redistribute them.
 #
 # See: https://www.crossref.org/documentation/retrieve-metadata/rest-api/rest-api-metadata-license-information/
-def filter_abstracts(row: pd.Series) -> str:
-    # If there's no abstract we can return immediately
-    if pd.isna(row["Abstract"]):
-        return pd.NA
+def filter_abstracts(df: pd.DataFrame) -> pd.Series:
+    # If the work is Creative Commons we can keep the abstract without checking
+    creative_commons = df["Usage rights"].str.contains("CC-", regex=False, na=False)
+
+    # Only check Crossref for the remaining works that have abstracts
+    check_crossref = df["Abstract"].notna() & ~creative_commons
+    on_crossref = map_concurrently(abstract_on_crossref, df.loc[check_crossref, "DOI"])
+    on_crossref = on_crossref.reindex(df.index, fill_value=False).astype(bool)
 
-    # If the work is Creative Commons we can return immediately
-    if pd.notna(row["Usage rights"]) and "CC-" in row["Usage rights"]:
-        return row["Abstract"]
+    return df["Abstract"].where(creative_commons | on_crossref)
 
-    # Check if the abstract is on Crossref
+
+# Check whether the publisher has deposited the work's abstract in Crossref
+def abstract_on_crossref(doi: str) -> bool:
     try:
         request_params = {"mailto": os.environ["EMAIL"]}
     except KeyError:
         request_params = {}
 
-    url = f"https://api.crossref.org/works/{row['DOI']}"
+    url = f"https://api.crossref.org/works/{doi}"
 
     r = requests.get(url, params=request_params)
 
     # HTTP 404 here means the DOI is not registered at Crossref
     if not r.ok:
-        return pd.NA
+        return False
 
-    data = r.json()
+    return "abstract" in r.json()["message"]
 
-    try:
-        data["message"]["abstract"]
-        return row["Abstract"]
-    except KeyError:
-        pass
-
-    return pd.NA
 
-
-def add_regions(countries):
+def add_regions(countries: pd.Series) -> pd.Series:
     """
-    Add regions for a list of countries.
+    Add UN regions for a Series of country lists.
     """
-    if pd.isna(countries):
-        return pd.NA
-
-    # Don't print "Tibet not found in regex" etc
-    coco_logger = coco.logging.getLogger()
-    coco_logger.setLevel(logging.CRITICAL)
+    return convert_countries(countries, to="UNRegion")
 
-    # Convert countries to UN regions
-    regions = cc.pandas_convert(series=pd.Series(countries.split("; ")), to="UNRegion")
 
-    # Reset log level
-    coco_logger.setLevel(logger.level)
-
-    regions = [region for region in regions if region != "not found"]
-
-    return "; ".join(regions)
-
-
-def add_continents(countries):
+def add_continents(countries: pd.Series) -> pd.Series:
     """
-    Add continents for a list of countries.
+    Add continents for a Series of country lists.
     """
-    if pd.isna(countries):
-        return pd.NA
+    return convert_countries(countries, to="Continent_7")
 
-    # Don't print "Tibet not found in regex" etc
-    coco_logger = coco.logging.getLogger()
-    coco_logger.setLevel(logging.CRITICAL)
-
-    # Convert to countries to continents
-    continents = cc.pandas_convert(
-        series=pd.Series(countries.split("; ")), to="Continent_7"
-    )
-
-    # Reset log level
-    coco_logger.setLevel(logger.level)
-
-    continents = [continent for continent in continents if continent != "not found"]
 
-    return "; ".join(continents)
-
-
-def retrieve_abstract_openalex(row: pd.Series) -> str:
+def retrieve_abstract_openalex(doi: str) -> str:
     """
-    Attempt to retrieve missing abstracts on OpenAlex.
+    Attempt to retrieve a missing abstract on OpenAlex.
     """
-    # If there's already an abstract we can return immediately
-    if pd.notna(row["Abstract"]):
-        return row["Abstract"]
-
     try:
         pyalex.config.email = os.environ["EMAIL"]
     except KeyError:
         pass
 
     try:
-        w = pyalex.Works()[row["DOI"]]
+        w = pyalex.Works()[doi]
     except requests.exceptions.HTTPError:
         return pd.NA
 
@@ -516,21 +638,17 @@ def retrieve_abstract_openalex(row: pd.Series) -> str:
     return w["abstract"]
 
 
-def retrieve_publisher_crossref(row: pd.Series) -> str:
+def retrieve_publisher_crossref(doi: str) -> str:
     """
-    Attempt to retrieve missing publishers from Crossref.
+    Attempt to retrieve a missing publisher from Crossref.
     """
-    # If there's already a publisher we can return immediately
-    if pd.notna(row["Publisher"]):
-        return row["Publisher"]
-
     # Check if the publisher is on Crossref
     try:
         request_params = {"mailto": os.environ["EMAIL"]}
     except KeyError:
         request_params = {}
 
-    url = f"https://api.crossref.org/works/{row['DOI']}"
+    url = f"https://api.crossref.org/works/{doi}"
 
     r = requests.get(url, params=request_params)
 
@@ -548,20 +666,17 @@ def retrieve_publisher_crossref(row: pd.Series) -> str:
     return publisher
 
 
-def retrieve_affiliations_openalex(row: pd.Series) -> str:
+def retrieve_affiliations_openalex(doi: str) -> str:
     """
     Attempt to retrieve missing affiliations from OpenAlex.
     """
-    if pd.notna(row["Author affiliations"]):
-        return row["Author affiliations"]
-
     try:
         pyalex.config.email = os.environ["EMAIL"]
     except KeyError:
         pass
 
     try:
-        w = pyalex.Works()[row["DOI"]]
+        w = pyalex.Works()[doi]
     except requests.exceptions.HTTPError:
         return pd.NA
 
@@ -580,34 +695,31 @@ def retrieve_affiliations_openalex(row: pd.Series) -> str:
     return "; ".join(affiliations)
 
 
-def extract_missing_countries(row: pd.Series) -> str:
+def extract_missing_countries(df: pd.DataFrame) -> pd.Series:
     """
     Attempt to extract missing countries from titles and abstracts.
 
     Note: this is very naive and unoptimized.
     """
-    if pd.notna(row["Countries"]):
-        return row["Countries"]
+    missing = df["Countries"].isna()
 
-    # Combine title and abstract for the search space
-    if pd.notna(row["Abstract"]):
-        search_space = row["Title"] + row["Abstract"]
-    else:
-        search_space = row["Title"]
+    # Combine title and abstract for the search space, only for the records we
+    # need to search
+    search_spaces = df.loc[missing, "Title"] + df.loc[missing, "Abstract"].fillna("")
 
-    countries = list()
+    # Try short names first, then official names
+    country_names = list(
+        dict.fromkeys(chain(cc.data.name_short.values, cc.data.name_official.values))
+    )
 
-    # Try short names first
-    for country in cc.data.name_short.values:
-        if country in search_space and country not in countries:
-            countries.append(country)
+    def find_countries(search_space: str) -> str:
+        return "; ".join(
+            country for country in country_names if country in search_space
+        )
 
-    # Then try official names
-    for country in cc.data.name_official.values:
-        if country in search_space and country not in countries:
-            countries.append(country)
+    countries = search_spaces.map(find_countries, na_action="ignore")
 
-    return "; ".join(countries)
+    return df["Countries"].fillna(countries)
 
 
 def normalize_affiliations(affiliations):